@@ -14,14 +14,33 @@ Notes:
 - This is for operational awareness / demo. Not medical diagnosis.
 """
 
-import os, json, time, struct, logging, math
+import os, json, time, struct, logging, math, threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from collections import deque
 from typing import Dict, Tuple, Optional, List
 
 import numpy as np
 import paho.mqtt.client as mqtt
-from scipy.signal import butter, filtfilt, iirnotch, find_peaks, welch
+from scipy.signal import butter, iirnotch, tf2sos, sosfiltfilt, find_peaks, welch
+
+try:
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+except Exception:  # pragma: no cover
+    def dumps(obj) -> str:
+        # stdlib fallback; numpy scalars are unwrapped via .item()
+        return json.dumps(obj, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+
+try:
+    from numba import njit
+except Exception:  # pragma: no cover
+    def njit(*args, **kwargs):
+        # plain-Python fallback when numba isn't installed
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
 
 # ---------------- Logging ----------------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -38,6 +57,8 @@ PUB_ALERT_FMT  = os.getenv("PUB_ALERT_FMT",  "Telemetry/{team}/{ff}/alerts")
 DEFAULT_FS = float(os.getenv("DEFAULT_FS", "130.0"))          # Polar H10 typically ~130 Hz for PMD ECG
 WINDOW_SEC = float(os.getenv("WINDOW_SEC", "30.0"))          # window for HRV
 MIN_SEC_FOR_ANALYSIS = float(os.getenv("MIN_SEC_FOR_ANALYSIS", "10.0"))
+ANALYSIS_EVERY_SEC = float(os.getenv("ANALYSIS_EVERY_SEC", "1.0"))  # min new data between analyses
+RING_LEN = int(WINDOW_SEC * DEFAULT_FS * 5)                   # raw sample ring per stream
 
 BANDPASS_LOW_HZ  = float(os.getenv("BANDPASS_LOW_HZ", "0.5"))
 BANDPASS_HIGH_HZ = float(os.getenv("BANDPASS_HIGH_HZ", "40.0"))
@@ -47,6 +68,9 @@ NOTCH_Q          = float(os.getenv("NOTCH_Q", "30.0"))
 REFRACTORY_SEC   = float(os.getenv("REFRACTORY_SEC", "0.25")) # 240 bpm max
 PEAK_PROM_FRAC   = float(os.getenv("PEAK_PROM_FRAC", "0.6"))
 
+# Baevsky histogram: fixed 50 ms bins spanning the RR gate in rr_from_peaks
+BAEVSKY_BINS_MS  = np.arange(250.0, 2550.0, 50.0)
+
 # ---------------- Alert thresholds (tune for your demo) ----------------
 TACHY_BPM        = float(os.getenv("TACHY_BPM", "170"))
 BRADY_BPM        = float(os.getenv("BRADY_BPM", "45"))
@@ -82,23 +106,28 @@ def s24le_to_int(x3: bytes) -> int:
         v |= 0xFF000000
     return struct.unpack("<i", struct.pack("<I", v & 0xFFFFFFFF))[0]
 
-def parse_ecg1_bundle(payload: bytes) -> List[bytes]:
+_U16LE = struct.Struct("<H")
+
+def parse_ecg1_bundle(payload: bytes) -> List[memoryview]:
     """
     Your edge packs multiple PMD packets into: b"ECG1" + ... + count + [lenLE + pkt]...
+    Packets are returned as zero-copy memoryview slices of the payload.
     """
     if len(payload) < 9 or payload[0:4] != b"ECG1":
         return []
     count = payload[8]
     idx = 9
+    end = len(payload)
+    mv = memoryview(payload)
     pkts = []
     for _ in range(count):
-        if idx + 2 > len(payload):
+        if idx + 2 > end:
             break
-        L = payload[idx] | (payload[idx + 1] << 8)
+        (L,) = _U16LE.unpack_from(payload, idx)
         idx += 2
-        if idx + L > len(payload):
+        if idx + L > end:
             break
-        pkts.append(payload[idx:idx + L])
+        pkts.append(mv[idx:idx + L])
         idx += L
     return pkts
 
@@ -115,20 +144,22 @@ def parse_polar_pmd_ecg_packet(pkt: bytes):
     n = len(data) // 3
     if n <= 0:
         return ts, np.array([], dtype=np.int32)
-    samples = np.empty(n, dtype=np.int32)
-    for i in range(n):
-        samples[i] = s24le_to_int(data[i*3:(i*3)+3])
+    # vectorized 24-bit LE decode (s24le_to_int kept for one-off use)
+    a = np.frombuffer(data, dtype=np.uint8, count=n * 3).reshape(n, 3).astype(np.int32)
+    samples = a[:, 0] | (a[:, 1] << 8) | (a[:, 2] << 16)
+    samples -= (samples & 0x800000) << 1
     return ts, samples
 
 # ---------------- Filters + SQI ----------------
-def design_filters(fs: float):
+def design_filters(fs: float) -> np.ndarray:
+    """Notch + bandpass cascaded into one SOS matrix (applied with a single sosfiltfilt)."""
     nyq = 0.5 * fs
     lo = BANDPASS_LOW_HZ / nyq
     hi = BANDPASS_HIGH_HZ / nyq
-    b_bp, a_bp = butter(4, [lo, hi], btype="bandpass")
+    sos_bp = butter(4, [lo, hi], btype="bandpass", output="sos")
     w0 = NOTCH_HZ / nyq
     b_n, a_n = iirnotch(w0, NOTCH_Q)
-    return (b_bp, a_bp), (b_n, a_n)
+    return np.vstack([tf2sos(b_n, a_n), sos_bp])
 
 def apply_filters(x: np.ndarray, fs: float, cache: dict):
     if len(x) < int(fs * 2):
@@ -136,11 +167,9 @@ def apply_filters(x: np.ndarray, fs: float, cache: dict):
     key = round(fs, 2)
     if key not in cache:
         cache[key] = design_filters(fs)
-    (b_bp, a_bp), (b_n, a_n) = cache[key]
-    y = x.astype(np.float64)
-    y = filtfilt(b_n, a_n, y)
-    y = filtfilt(b_bp, a_bp, y)
-    return y
+    sos = cache[key]
+    # explicit odd-extension length: 3 samples per filter order (2 per section)
+    return sosfiltfilt(sos, x.astype(np.float64), padlen=3 * 2 * sos.shape[0])
 
 def ecg_sqi(raw: np.ndarray, fs: float) -> float:
     """
@@ -160,23 +189,32 @@ def ecg_sqi(raw: np.ndarray, fs: float) -> float:
     if identical > 0.25:
         return 0.1
 
+    # one partition for all four quantiles
+    lo_ex, lo, hi, hi_ex = np.percentile(x, [0.1, 1, 99, 99.9])
+
     # dynamic range
-    p2p = np.percentile(x, 99) - np.percentile(x, 1)
+    p2p = hi - lo
     if p2p < 200:  # depends on your scaling; keep conservative
         base = 0.15
     else:
         base = clamp(p2p / 8000.0, 0.15, 1.0)
 
     # clipping
-    hi = np.percentile(x, 99.9)
-    lo = np.percentile(x, 0.1)
-    clip_frac = float(np.mean((x >= hi) | (x <= lo)))
+    clip_frac = float(np.mean((x >= hi_ex) | (x <= lo_ex)))
     clip_pen = clamp(1.0 - 2.5 * clip_frac, 0.0, 1.0)
 
     # spectral sanity: band (0.5-40) vs total (0-65)
-    f, Pxx = welch(x - np.mean(x), fs=fs, nperseg=min(len(x), int(fs*4)))
-    total = np.trapz(Pxx[(f >= 0.1) & (f <= min(65.0, fs/2-1e-6))], f[(f >= 0.1) & (f <= min(65.0, fs/2-1e-6))]) + 1e-12
-    band  = np.trapz(Pxx[(f >= 0.5) & (f <= min(40.0, fs/2-1e-6))], f[(f >= 0.5) & (f <= min(40.0, fs/2-1e-6))])
+    # one Welch + one cumulative trapezoid; both band integrals are O(1) lookups
+    f, Pxx = welch(x, fs=fs, nperseg=min(len(x), int(fs*4)), detrend="constant")
+    cP = np.concatenate(([0.0], np.cumsum(0.5 * (Pxx[1:] + Pxx[:-1]) * np.diff(f))))
+
+    def _span(lo, hi):
+        i0 = int(np.searchsorted(f, lo, side="left"))
+        i1 = int(np.searchsorted(f, hi, side="right")) - 1
+        return float(cP[i1] - cP[i0]) if i1 > i0 else 0.0
+
+    total = _span(0.1, min(65.0, fs/2-1e-6)) + 1e-12
+    band  = _span(0.5, min(40.0, fs/2-1e-6))
     band_ratio = clamp(float(band / total), 0.0, 1.0)
 
     sqi = base * clip_pen * (0.4 + 0.6 * band_ratio)
@@ -190,7 +228,11 @@ def qrs_detect(ecg_f: np.ndarray, fs: float) -> np.ndarray:
     d = np.diff(ecg_f, prepend=ecg_f[0])
     e = d * d
     win = max(3, int(0.150 * fs))
-    mwi = np.convolve(e, np.ones(win) / win, mode="same")
+    # O(N) prefix-sum moving average, same alignment/zero-padding as convolve(mode="same")
+    n = len(e)
+    csum = np.concatenate(([0.0], np.cumsum(e)))
+    j = np.arange(n) + (win - 1) // 2
+    mwi = (csum[np.minimum(j + 1, n)] - csum[np.maximum(j - win + 1, 0)]) / win
 
     med = np.median(mwi)
     mad = np.median(np.abs(mwi - med)) + 1e-12
@@ -199,13 +241,15 @@ def qrs_detect(ecg_f: np.ndarray, fs: float) -> np.ndarray:
     dist = int(REFRACTORY_SEC * fs)
     peaks, _ = find_peaks(mwi, distance=dist, prominence=prom)
 
-    refined = []
+    if len(peaks) == 0:
+        return np.array([], dtype=int)
+
+    # refine on the filtered ECG: argmax over an (n_peaks, 2*search+1) window matrix
     search = int(0.08 * fs)
-    for p in peaks:
-        a = max(0, p - search)
-        b = min(len(ecg_f), p + search + 1)
-        refined.append(a + int(np.argmax(ecg_f[a:b])))
-    return np.array(refined, dtype=int)
+    base = peaks[:, None] + np.arange(-search, search + 1)[None, :]
+    np.clip(base, 0, len(ecg_f) - 1, out=base)
+    refined = base[np.arange(len(peaks)), np.argmax(ecg_f[base], axis=1)]
+    return refined.astype(int)
 
 def rr_from_peaks(peaks: np.ndarray, fs: float) -> Optional[np.ndarray]:
     if len(peaks) < 3:
@@ -217,13 +261,17 @@ def rr_from_peaks(peaks: np.ndarray, fs: float) -> Optional[np.ndarray]:
         return None
     return rr
 
-def clean_rr(rr: np.ndarray) -> np.ndarray:
+def _rr_robust_stats(rr: np.ndarray) -> Tuple[float, float]:
+    """Median and MAD of RR (shared by clean_rr and the ectopy proxy)."""
+    med = np.median(rr)
+    dev = np.median(np.abs(rr - med)) + 1e-9
+    return med, dev
+
+def clean_rr(rr: np.ndarray, med: float, dev: float) -> np.ndarray:
     """
     Light ectopy/outlier cleaning: remove RR far from median (winsor-ish).
     Keeps demo stable without hiding everything.
     """
-    med = np.median(rr)
-    dev = np.median(np.abs(rr - med)) + 1e-9
     lo = med - 4.0 * dev
     hi = med + 4.0 * dev
     rr2 = rr[(rr >= lo) & (rr <= hi)]
@@ -235,27 +283,27 @@ def time_domain_hrv(rr: np.ndarray) -> dict:
     diff = np.diff(rr_ms)
     bpm = 60.0 / np.median(rr) if np.median(rr) > 0 else None
 
-    sdnn = float(np.std(rr_ms, ddof=1)) if len(rr_ms) >= 2 else None
-    rmssd = float(np.sqrt(np.mean(diff**2))) if len(diff) >= 2 else None
-    pnn50 = float(np.mean(np.abs(diff) > 50.0) * 100.0) if len(diff) >= 2 else None
-    pnn20 = float(np.mean(np.abs(diff) > 20.0) * 100.0) if len(diff) >= 2 else None
+    sdnn = np.std(rr_ms, ddof=1) if len(rr_ms) >= 2 else None
+    rmssd = np.sqrt(np.mean(diff**2)) if len(diff) >= 2 else None
+    pnn50 = np.mean(np.abs(diff) > 50.0) * 100.0 if len(diff) >= 2 else None
+    pnn20 = np.mean(np.abs(diff) > 20.0) * 100.0 if len(diff) >= 2 else None
 
-    mean_rr = float(np.mean(rr))
-    cvrr = float(np.std(rr, ddof=1) / (mean_rr + 1e-9)) if len(rr) >= 2 else None
+    mean_rr = np.mean(rr)
+    cvrr = np.std(rr, ddof=1) / (mean_rr + 1e-9) if len(rr) >= 2 else None
 
     # Poincaré
     if len(rr_ms) >= 3:
         rr1 = rr_ms[:-1]
         rr2 = rr_ms[1:]
-        sd1 = float(np.sqrt(np.var((rr2 - rr1) / np.sqrt(2), ddof=1)))
-        sd2 = float(np.sqrt(np.var((rr2 + rr1) / np.sqrt(2), ddof=1)))
+        sd1 = np.sqrt(np.var((rr2 - rr1) / np.sqrt(2), ddof=1))
+        sd2 = np.sqrt(np.var((rr2 + rr1) / np.sqrt(2), ddof=1))
     else:
         sd1, sd2 = None, None
 
     return {
-        "bpm": float(bpm) if bpm is not None else None,
-        "rr_ms_mean": float(np.mean(rr_ms)),
-        "rr_ms_med": float(np.median(rr_ms)),
+        "bpm": bpm,
+        "rr_ms_mean": np.mean(rr_ms),
+        "rr_ms_med": np.median(rr_ms),
         "sdnn_ms": sdnn,
         "rmssd_ms": rmssd,
         "pnn50_pct": pnn50,
@@ -266,21 +314,39 @@ def time_domain_hrv(rr: np.ndarray) -> dict:
         "n_rr": int(len(rr)),
     }
 
+_tacho_grid: Dict[Tuple[int, float], np.ndarray] = {}
+
 def interpolate_tachogram(rr: np.ndarray, fs_resample: float = 4.0):
     """
     For frequency-domain HRV:
     - build cumulative time of RR
     - interpolate instantaneous RR to uniform grid
     """
-    t = np.cumsum(rr)
-    t = t - t[0]
+    t = np.empty(len(rr))
+    np.cumsum(rr, out=t)
+    t -= t[0]
     if t[-1] < 10.0:
         return None, None
-    tt = np.arange(0.0, t[-1], 1.0/fs_resample)
+    # same grid as np.arange(0, t[-1], 1/fs): cached per quantized duration
+    k = int(np.ceil(t[-1] * fs_resample))
+    key = (k, fs_resample)
+    tt = _tacho_grid.get(key)
+    if tt is None:
+        tt = np.arange(k) / fs_resample
+        tt.flags.writeable = False
+        _tacho_grid[key] = tt
     rr_i = np.interp(tt, t, rr)
     rr_i = rr_i - np.mean(rr_i)
     return tt, rr_i
 
+def _band_int(P: np.ndarray, f: np.ndarray, lo: float, hi: float) -> Optional[float]:
+    """Trapezoid integral of P over lo <= f < hi on a uniform Welch grid (None if empty)."""
+    i0, i1 = np.searchsorted(f, (lo, hi))
+    if i1 <= i0:
+        return None
+    df = f[1] - f[0]
+    return df * (P[i0:i1].sum() - 0.5 * (P[i0] + P[i1 - 1]))
+
 def freq_domain_hrv(rr: np.ndarray) -> dict:
     """
     LF: 0.04–0.15 Hz, HF: 0.15–0.40 Hz
@@ -290,24 +356,39 @@ def freq_domain_hrv(rr: np.ndarray) -> dict:
         return {"lf_power": None, "hf_power": None, "lf_hf": None}
 
     f, Pxx = welch(rr_i, fs=4.0, nperseg=min(len(rr_i), 256))
-    def bandpower(lo, hi):
-        m = (f >= lo) & (f < hi)
-        if not np.any(m):
-            return None
-        return float(np.trapz(Pxx[m], f[m]))
-
-    lf = bandpower(0.04, 0.15)
-    hf = bandpower(0.15, 0.40)
+    lf = _band_int(Pxx, f, 0.04, 0.15)
+    hf = _band_int(Pxx, f, 0.15, 0.40)
     if lf is None or hf is None or hf <= 1e-12:
         lf_hf = None
     else:
-        lf_hf = float(lf / hf)
+        lf_hf = lf / hf
     return {"lf_power": lf, "hf_power": hf, "lf_hf": lf_hf}
 
+@njit(cache=True, fastmath=True)
+def _sampen_phi(x, mm, tol):
+    N = x.shape[0]
+    count = 0
+    total = 0
+    for i in range(N - mm):
+        for j in range(i + 1, N - mm + 1):
+            match = True
+            for k in range(mm):
+                if abs(x[i + k] - x[j + k]) > tol:
+                    match = False
+                    break
+            if match:
+                count += 1
+        total += N - mm - i
+    return count / (total + 1e-12)
+
+@njit(cache=True, fastmath=True)
+def _sampen_core(x, m, tol):
+    return _sampen_phi(x, m + 1, tol), _sampen_phi(x, m, tol)
+
 def sample_entropy(x: np.ndarray, m: int = 2, r: float = 0.2) -> Optional[float]:
     """
     SampEn of RR (seconds). r is fraction of std.
-    O(N^2) but RR per window is small => OK.
+    O(N^2) counting runs in _sampen_core (Numba-compiled when available).
     """
     if len(x) < (m + 2):
         return None
@@ -317,21 +398,7 @@ def sample_entropy(x: np.ndarray, m: int = 2, r: float = 0.2) -> Optional[float]
         return 0.0
     tol = r * sd
 
-    def _phi(mm):
-        N = len(x)
-        count = 0
-        total = 0
-        for i in range(N - mm):
-            xi = x[i:i+mm]
-            for j in range(i+1, N - mm + 1):
-                xj = x[j:j+mm]
-                if np.max(np.abs(xi - xj)) <= tol:
-                    count += 1
-            total += (N - mm - i)
-        return count / (total + 1e-12)
-
-    A = _phi(m+1)
-    B = _phi(m)
+    A, B = _sampen_core(x, m, tol)
     if A <= 1e-12 or B <= 1e-12:
         return None
     return float(-np.log(A / B))
@@ -347,17 +414,17 @@ def baevsky_stress_index(rr: np.ndarray) -> Optional[float]:
     rr_ms = rr * 1000.0
     if len(rr_ms) < 10:
         return None
-    # histogram binning (50 ms bins)
-    bins = np.arange(np.min(rr_ms), np.max(rr_ms) + 50.0, 50.0)
-    if len(bins) < 3:
+    rng_ms = np.ptp(rr_ms)
+    if rng_ms <= 50.0:
         return None
-    hist, edges = np.histogram(rr_ms, bins=bins)
+    # histogram binning (fixed 50 ms grid)
+    hist, edges = np.histogram(rr_ms, bins=BAEVSKY_BINS_MS)
     if np.sum(hist) == 0:
         return None
     i_mode = int(np.argmax(hist))
     mo_ms = 0.5 * (edges[i_mode] + edges[i_mode+1])
     amo = float(hist[i_mode] / np.sum(hist) * 100.0)
-    mxdmn_s = float((np.max(rr_ms) - np.min(rr_ms)) / 1000.0) + 1e-9
+    mxdmn_s = float(rng_ms / 1000.0) + 1e-9
     mo_s = float(mo_ms / 1000.0) + 1e-9
     si = amo / (2.0 * mo_s * mxdmn_s)
     return float(si)
@@ -467,10 +534,19 @@ def cardiac_risk_score(metrics: dict) -> Optional[float]:
 @dataclass
 class StreamState:
     fs_est: float = DEFAULT_FS
-    buf: deque = field(default_factory=lambda: deque(maxlen=int(DEFAULT_FS * WINDOW_SEC * 4)))
+    buf: np.ndarray = field(default_factory=lambda: np.zeros(RING_LEN, dtype=np.int32))
+    head: int = 0       # next write index
+    filled: int = 0     # valid samples in ring
+    samples_since_analysis: int = 0
+    # held while a worker analyses this stream (one analysis per stream at a time)
+    busy: threading.Lock = field(default_factory=threading.Lock, repr=False)
     last_ts: Optional[int] = None
     last_n: Optional[int] = None
 
+    # publish topics, formatted once per (team, ff)
+    telem_topic: str = ""
+    alert_topic: str = ""
+
     # baseline tracking (for relative indices)
     baseline_hr: float = 85.0
     baseline_rmssd: float = 30.0
@@ -483,9 +559,39 @@ class StreamState:
     auc_last_tc: Optional[float] = None
     auc_last_t: Optional[float] = None
 
+    def push(self, samples: np.ndarray):
+        cap = len(self.buf)
+        n = len(samples)
+        if n >= cap:
+            self.buf[:] = samples[-cap:]
+            self.head = 0
+            self.filled = cap
+            return
+        end = self.head + n
+        if end <= cap:
+            self.buf[self.head:end] = samples
+        else:
+            k = cap - self.head
+            self.buf[self.head:] = samples[:k]
+            self.buf[:end - cap] = samples[k:]
+        self.head = end % cap
+        self.filled = min(cap, self.filled + n)
+
+    def latest(self, n: int) -> np.ndarray:
+        """Last n samples in arrival order (view when contiguous)."""
+        n = min(n, self.filled)
+        start = self.head - n
+        if start >= 0:
+            return self.buf[start:self.head]
+        return np.concatenate((self.buf[start:], self.buf[:self.head]))
+
 states: Dict[Tuple[str, str], StreamState] = {}
 filt_cache: dict = {}
 
+# analysis runs off the MQTT network thread; SciPy/NumPy release the GIL in the heavy parts
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(os.cpu_count() or 2)))
+pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="biomed")
+
 def update_baselines(st: StreamState, bpm: float, rmssd: Optional[float], tc: float):
     # slow EMA so baselines are stable
     st.baseline_hr = 0.98 * st.baseline_hr + 0.02 * bpm
@@ -523,15 +629,18 @@ def update_heat_auc(st: StreamState, tc: float, t_now: float):
     st.auc_last_tc = tc
 
 # ---------------- Publishing ----------------
-def publish(client: mqtt.Client, team: str, ff: str, payload: dict, alerts: List[dict]):
-    client.publish(PUB_TELEM_FMT.format(team=team, ff=ff), json.dumps(payload), qos=0)
+def publish(client: mqtt.Client, st: StreamState, team: str, ff: str, payload: dict, alerts: List[dict]):
+    # build the whole tick first, then flush back-to-back on the live connection
+    batch = [(st.telem_topic, dumps(payload))]
     if alerts:
-        client.publish(PUB_ALERT_FMT.format(team=team, ff=ff), json.dumps({
+        batch.append((st.alert_topic, dumps({
             "teamId": team,
             "ffId": ff,
             "observedAt": payload.get("observedAt", now_iso()),
             "alerts": alerts
-        }), qos=0)
+        })))
+    for topic, body in batch:
+        client.publish(topic, body, qos=0)
 
 # ---------------- MQTT callbacks ----------------
 def on_connect(client, userdata, flags, rc, properties=None):
@@ -552,7 +661,8 @@ def on_message(client, userdata, msg):
     if key not in states:
         states[key] = StreamState(
             fs_est=DEFAULT_FS,
-            buf=deque(maxlen=int(WINDOW_SEC * DEFAULT_FS * 5))
+            telem_topic=PUB_TELEM_FMT.format(team=team, ff=ff),
+            alert_topic=PUB_ALERT_FMT.format(team=team, ff=ff),
         )
     st = states[key]
 
@@ -575,17 +685,39 @@ def on_message(client, userdata, msg):
         st.last_ts = ts
         st.last_n = len(samples)
 
-        for v in samples:
-            st.buf.append(int(v))
+        st.push(samples)
+        st.samples_since_analysis += len(samples)
 
     fs = float(st.fs_est)
     need = int(MIN_SEC_FOR_ANALYSIS * fs)
-    if len(st.buf) < need:
+    if st.filled < need:
         return
-
-    n = min(int(WINDOW_SEC * fs), len(st.buf))
-    raw = np.array(list(st.buf)[-n:], dtype=np.float64)
-
+    # decouple analysis cadence from packet cadence
+    if st.samples_since_analysis < int(ANALYSIS_EVERY_SEC * fs):
+        return
+    # previous window for this stream still running: keep buffering, try again next bundle
+    if not st.busy.acquire(blocking=False):
+        return
+    st.samples_since_analysis = 0
+
+    # snapshot the window (astype copies) so ingest can keep writing the ring
+    n = min(int(WINDOW_SEC * fs), st.filled)
+    raw = st.latest(n).astype(np.float64)
+    try:
+        pool.submit(_analyze_and_publish, client, st, team, ff, raw, fs)
+    except Exception:
+        st.busy.release()
+        raise
+
+def _analyze_and_publish(client, st: StreamState, team: str, ff: str, raw: np.ndarray, fs: float):
+    try:
+        _analyze(client, st, team, ff, raw, fs)
+    except Exception:
+        logging.exception("analysis failed for %s/%s", team, ff)
+    finally:
+        st.busy.release()
+
+def _analyze(client, st: StreamState, team: str, ff: str, raw: np.ndarray, fs: float):
     # SQI + filter + QRS
     sqi = ecg_sqi(raw, fs)
     flt = apply_filters(raw, fs, filt_cache)
@@ -594,7 +726,11 @@ def on_message(client, userdata, msg):
     if rr is None:
         return
 
-    rr = clean_rr(rr)
+    # ectopy ratio proxy: fraction of RR far from median, using the same
+    # robust stats that clean_rr uses to drop outliers
+    med, dev = _rr_robust_stats(rr)
+    ect = float(np.mean((rr < med - 3*dev) | (rr > med + 3*dev)))
+    rr = clean_rr(rr, med, dev)
 
     # HRV metrics
     td = time_domain_hrv(rr)
@@ -602,12 +738,6 @@ def on_message(client, userdata, msg):
     sampen = sample_entropy(rr, m=2, r=0.2)
     si = baevsky_stress_index(rr)
 
-    # ectopy ratio proxy: fraction of RR removed by clean_rr (approx)
-    # (we can estimate as how many are far from median)
-    med = np.median(rr)
-    dev = np.median(np.abs(rr - med)) + 1e-9
-    ect = float(np.mean((rr < med - 3*dev) | (rr > med + 3*dev)))
-
     bpm = td.get("bpm")
     if bpm is None:
         return
@@ -630,7 +760,7 @@ def on_message(client, userdata, msg):
         "observedAt": now_iso(),
         "source": "biomed_agent_strong",
         "fs_est_hz": round(fs, 2),
-        "sqi": float(sqi),
+        "sqi": sqi,
 
         # Time-domain HRV
         **td,
@@ -656,11 +786,7 @@ def on_message(client, userdata, msg):
     }
 
     # scores
-    metrics["fatigue_score_0_100"] = fatigue_score({
-        **metrics,
-        "lf_hf": fd.get("lf_hf"),
-        "rmssd_ms": td.get("rmssd_ms"),
-    })
+    metrics["fatigue_score_0_100"] = fatigue_score(metrics)
     metrics["cardiac_risk_score_0_100"] = cardiac_risk_score(metrics)
 
     # Alerts
@@ -707,7 +833,7 @@ def on_message(client, userdata, msg):
             alerts.append({"type": "cardiac_concern", "severity": "danger",
                            "msg": f"Elevated cardiac concern {cr:.0f}/100 (operational flag)"})
 
-    publish(client, team, ff, metrics, alerts)
+    publish(client, st, team, ff, metrics, alerts)
 
 def main():
     client = mqtt.Client()
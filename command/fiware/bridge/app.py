@@ -1,10 +1,19 @@
 import os
+import math
+import atexit
 import logging
 from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+try:
+    import orjson
+    _loads = orjson.loads
+except Exception:  # pragma: no cover
+    import json
+    _loads = json.loads
+
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import WriteOptions
 
 # ------------------ LOGGING ------------------
 logging.basicConfig(
@@ -25,13 +34,31 @@ INFLUX_BUCKET = os.getenv("INFLUX_BUCKET")
 # If set, forces one measurement name; if empty, use entity_type as measurement
 MEASUREMENT = os.getenv("INFLUX_MEASUREMENT", "").strip()
 
+INFLUX_BATCH_SIZE = int(os.getenv("INFLUX_BATCH_SIZE", "500"))
+INFLUX_FLUSH_MS = int(os.getenv("INFLUX_FLUSH_MS", "1000"))
+
 if not all([INFLUX_TOKEN, INFLUX_ORG, INFLUX_BUCKET]):
     raise RuntimeError("Missing INFLUX_TOKEN / INFLUX_ORG / INFLUX_BUCKET env vars")
 
 client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
 
-# Synchronous writes so you SEE errors immediately
-write_api = client.write_api(write_options=SYNCHRONOUS)
+# Batched background writes: /notify returns after enqueue, not after the Influx ACK.
+# Write errors surface through the callback below instead of the HTTP response.
+def _on_write_error(conf, data, exception):
+    log.error("Influx batch write failed (%s): %s", conf, exception)
+
+
+write_api = client.write_api(
+    write_options=WriteOptions(batch_size=INFLUX_BATCH_SIZE, flush_interval=INFLUX_FLUSH_MS),
+    error_callback=_on_write_error,
+)
+
+
+@atexit.register
+def _close_influx():
+    # flush whatever is still queued before the process exits
+    write_api.close()
+    client.close()
 
 # ------------------ HELPERS ------------------
 def attr_value(x):
@@ -63,27 +90,42 @@ def parse_time(ent: dict) -> datetime:
 TAG_KEYS = ("teamId", "ffId", "nodeId", "originNodeId", "via", "source")
 KEEP_STR_FIELDS = ("severity", "reason", "status", "via", "source")
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-def build_point(ent: dict) -> tuple[Point, int]:
+# Line protocol escaping (https://docs.influxdata.com/influxdb/v2/reference/syntax/line-protocol/)
+_MEAS_ESC = str.maketrans({",": "\\,", " ": "\\ ", "\n": "\\n"})
+_KEY_ESC = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n"})
+_STR_ESC = str.maketrans({'"': '\\"', "\\": "\\\\"})
+
+
+def to_ns(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    d = ts - _EPOCH
+    return (d.days * 86400 + d.seconds) * 1_000_000_000 + d.microseconds * 1000
+
+
+def build_line(ent: dict) -> tuple[str, int]:
+    """One entity -> one line-protocol record (no Point objects)."""
     ent_id = ent.get("id", "unknown")
     ent_type = ent.get("type", "unknown")
 
     measurement = MEASUREMENT if MEASUREMENT else ent_type
 
-    p = Point(measurement).tag("entity_id", ent_id).tag("entity_type", ent_type)
+    tags = [
+        measurement.translate(_MEAS_ESC),
+        "entity_id=" + str(ent_id).translate(_KEY_ESC),
+        "entity_type=" + str(ent_type).translate(_KEY_ESC),
+    ]
 
     # Promote key identifiers to tags if present
     for k in TAG_KEYS:
         v = attr_value(ent.get(k))
         if isinstance(v, str) and v:
-            p.tag(k, v)
-
-    # Time
-    ts = parse_time(ent)
-    p.time(ts, WritePrecision.NS)
+            tags.append(k + "=" + v.translate(_KEY_ESC))
 
     # Fields
-    field_count = 0
+    fields = []
     for k, v in ent.items():
         if k in ("id", "type"):
             continue
@@ -92,31 +134,30 @@ def build_point(ent: dict) -> tuple[Point, int]:
 
         # Booleans
         if isinstance(val, bool):
-            p.field(k, int(val))
-            field_count += 1
+            fields.append(f"{k.translate(_KEY_ESC)}={int(val)}i")
             continue
 
-        # Numbers
+        # Numbers (line protocol has no NaN/inf)
         if isinstance(val, (int, float)):
-            p.field(k, float(val))
-            field_count += 1
+            val = float(val)
+            if math.isfinite(val):
+                fields.append(f"{k.translate(_KEY_ESC)}={val!r}")
             continue
 
         # Useful strings (limited)
         if isinstance(val, str) and k in KEEP_STR_FIELDS and val:
-            p.field(k, val)
-            field_count += 1
+            fields.append(f'{k.translate(_KEY_ESC)}="{val.translate(_STR_ESC)}"')
             continue
 
         # If Orion sends a value that is a dict/list (rare in normalized), skip it.
         # (If you ever need it, stringify intentionally.)
 
     # IMPORTANT: ensure at least ONE field so Influx never discards a point
-    if field_count == 0:
-        p.field("_ingest", 1)
-        field_count = 1
+    if not fields:
+        fields.append("_ingest=1i")
 
-    return p, field_count
+    line = f"{','.join(tags)} {','.join(fields)} {to_ns(parse_time(ent))}"
+    return line, len(fields)
 
 
 # ------------------ ROUTES ------------------
@@ -127,21 +168,27 @@ def health():
 
 @app.route("/notify", methods=["POST"])
 def notify():
-    payload = request.get_json(silent=True) or {}
+    # parse the raw body directly (faster than request.get_json for Orion bursts)
+    try:
+        payload = _loads(request.get_data()) if request.content_length else {}
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
     data = payload.get("data", [])
 
     if not isinstance(data, list) or not data:
         # Still OK; Orion sometimes sends empty batches
         return jsonify({"ok": True, "written": 0}), 200
 
-    points = []
+    lines = []
     total_fields = 0
 
-    # Build points
+    # Build line protocol
     for ent in data:
         try:
-            p, nfields = build_point(ent)
-            points.append(p)
+            line, nfields = build_line(ent)
+            lines.append(line)
             total_fields += nfields
         except Exception as e:
             log.exception(
@@ -153,8 +200,13 @@ def notify():
 
     # Write
     try:
-        if points:
-            write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=points)
+        if lines:
+            write_api.write(
+                bucket=INFLUX_BUCKET,
+                org=INFLUX_ORG,
+                record="\n".join(lines).encode("utf-8"),
+                write_precision=WritePrecision.NS,
+            )
 
         # Log a compact summary (this is what you were missing)
         types = {}
@@ -165,16 +217,17 @@ def notify():
         log.info(
             "notify: entities=%d points=%d fields=%d bucket=%s types=%s",
             len(data),
-            len(points),
+            len(lines),
             total_fields,
             INFLUX_BUCKET,
             types,
         )
 
-        return jsonify({"ok": True, "written": len(points)}), 200
+        return jsonify({"ok": True, "written": len(lines)}), 200
 
     except Exception as e:
-        # IMPORTANT: return 500 so Orion shows notification failure (and you see it)
+        # IMPORTANT: return 500 so Orion shows notification failure (and you see it);
+        # with batching this only covers enqueue errors, flush errors go to _on_write_error
         log.exception("Influx write failed: %s", e)
         return jsonify({"ok": False, "error": str(e)}), 500
 
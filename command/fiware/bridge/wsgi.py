@@ -0,0 +1,3 @@
+# Gunicorn entrypoint: gunicorn -w 4 -k gthread --threads 2 -b 0.0.0.0:8666 wsgi:app
+# (app.py still runs standalone with the Flask dev server for local debugging)
+from app import app  # noqa: F401
@@ -0,0 +1,333 @@
+"""
+Helpers shared by api.py and api3.py: env, time/number helpers, the process-wide
+Influx and HTTP clients, and the /api/latest Flux query.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, Request, Response
+from influxdb_client import BucketRetentionRules, InfluxDBClient, TaskCreateRequest
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+if orjson is not None:
+    _dumps = orjson.dumps
+else:  # pragma: no cover
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+log = logging.getLogger("command-api")
+
+# ---- ENV ----
+INFLUX_URL = os.getenv("INFLUX_URL", "http://influxdb:8086")
+INFLUX_TOKEN = os.getenv("INFLUX_TOKEN", "")
+INFLUX_ORG = os.getenv("INFLUX_ORG", "")
+INFLUX_BUCKET = os.getenv("INFLUX_BUCKET", "")
+
+# /api/latest reads LATEST_BUCKET; point it at a rollup bucket (e.g. "IoT_1s") and
+# ensure_latest_rollup() keeps it filled with one last() point per series per second
+LATEST_BUCKET = os.getenv("LATEST_BUCKET", "") or INFLUX_BUCKET
+LATEST_ROLLUP_EVERY = os.getenv("LATEST_ROLLUP_EVERY", "5s")
+LATEST_ROLLUP_RETENTION_SEC = int(os.getenv("LATEST_ROLLUP_RETENTION_SEC", str(24 * 3600)))
+
+# If your measurements differ, change here
+MEAS_ENV = os.getenv("MEAS_ENV", "Environment")
+MEAS_BIO = os.getenv("MEAS_BIO", "Biomedical")
+MEAS_LOC = os.getenv("MEAS_LOC", "Location")
+
+# /api/latest response cache (dashboards poll every few seconds)
+LATEST_CACHE_TTL_SEC = float(os.getenv("LATEST_CACHE_TTL_SEC", "3"))
+# team comes straight from the query string, so the cache is capped
+LATEST_CACHE_MAX = int(os.getenv("LATEST_CACHE_MAX", "256"))
+
+
+def now_utc() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def safe_float(x) -> Optional[float]:
+    try:
+        if x is None:
+            return None
+        return float(x)
+    except Exception:
+        return None
+
+
+def coerce(x) -> Optional[float]:
+    # inline fast path for Influx values, which are already numeric in the common case
+    if isinstance(x, (int, float)):
+        return float(x)
+    return safe_float(x) if isinstance(x, str) else None
+
+
+def need_influx():
+    if not (INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET):
+        raise HTTPException(500, "Missing INFLUX_TOKEN/INFLUX_ORG/INFLUX_BUCKET in environment")
+
+
+# One Influx client for the whole process (built on first use, closed at shutdown)
+_INFLUX: Optional[InfluxDBClient] = None
+_QUERY_API = None
+
+
+def get_query_api():
+    global _INFLUX, _QUERY_API
+    need_influx()
+    if _QUERY_API is None:
+        _INFLUX = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG, enable_gzip=True)
+        _QUERY_API = _INFLUX.query_api()
+    return _QUERY_API
+
+
+def close_influx() -> None:
+    global _INFLUX, _QUERY_API
+    try:
+        if _INFLUX is not None:
+            _INFLUX.close()
+    except Exception:
+        pass
+    _INFLUX = None
+    _QUERY_API = None
+
+
+def etag_json(request: Request, payload: Any, max_age: int = 1) -> Response:
+    """
+    Encode `payload` once and tag it with a content hash; a poller that sends the
+    same hash back in If-None-Match gets an empty 304 instead of the body.
+    """
+    body = _dumps(payload)
+    etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": f"max-age={max_age}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Shared async HTTP client (keeps connections alive between requests;
+# HTTP/2 when the optional h2 package is installed)
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except Exception:  # pragma: no cover
+    _HTTP2 = False
+_http: Optional[httpx.AsyncClient] = None
+
+
+def http_client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(5.0, connect=2.0),
+            http2=_HTTP2,
+            limits=httpx.Limits(max_connections=128, max_keepalive_connections=64),
+        )
+    return _http
+
+
+async def aclose_http() -> None:
+    global _http
+    try:
+        if _http is not None:
+            await _http.aclose()
+    except Exception:
+        pass
+    _http = None
+
+
+# -----------------------------------------------------------------------------
+# /api/latest
+# -----------------------------------------------------------------------------
+# Fields /api/latest passes through (the Flux filter below selects exactly these)
+WANTED_FIELDS = (
+    "hrBpm", "rrMs",
+    "tempC", "humidityPct",
+    "mq2Raw", "mq2Digital", "coPpm",
+    "stressIndex", "fatigueIndex", "riskScore",
+    "heatRisk", "gasRisk", "heatIndexC",
+    "rmssdMs", "sdnnMs", "pnn50Pct",
+    "separationRisk",
+    "lat", "lon",
+)
+
+# Full key set of a member record, so each dict is allocated at its final size
+EMPTY_MEMBER: Dict[str, Any] = {"observedAt": None, **{f: None for f in WANTED_FIELDS}}
+# Built once from WANTED_FIELDS. An OR of equality tests (unlike contains()) can be
+# pushed down into Influx's storage read, so unwanted fields are never decoded.
+FIELD_FILTER = " or ".join(f'r["_field"] == "{f}"' for f in WANTED_FIELDS)
+
+# team and window arrive as params.*, so the text (and Influx's compiled plan) never changes
+_FLUX_LATEST = f'''
+lastByFF = from(bucket: "{LATEST_BUCKET}")
+  |> range(start: duration(v: params.range))
+  |> filter(fn: (r) => r["teamId"] == params.team)
+  |> filter(fn: (r) =>
+      r["_measurement"] == "{MEAS_ENV}" or
+      r["_measurement"] == "{MEAS_BIO}" or
+      r["_measurement"] == "{MEAS_LOC}"
+  )
+  |> filter(fn: (r) => {FIELD_FILTER})
+  |> last()
+  |> toFloat()
+  |> group(columns: ["ffId","_field"])
+  |> max(column: "_time")
+
+// one row per FF with every field as a column
+lastByFF
+  |> group(columns: ["ffId"])
+  |> pivot(rowKey: ["ffId"], columnKey: ["_field"], valueColumn: "_value")
+  |> yield(name: "values")
+
+// newest sample time per FF (pivot on ffId drops _time)
+lastByFF
+  |> group(columns: ["ffId"])
+  |> max(column: "_time")
+  |> keep(columns: ["_time","ffId"])
+  |> yield(name: "times")
+'''
+
+
+# Influx task behind LATEST_BUCKET: raw points of the /api/latest fields, thinned to
+# the last value per series per second. `offset` lets late bridge writes land first.
+LATEST_ROLLUP_TASK = "iot_latest_rollup"
+_FLUX_ROLLUP = f'''
+option task = {{name: "{LATEST_ROLLUP_TASK}", every: {LATEST_ROLLUP_EVERY}, offset: 2s}}
+
+from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: -task.every)
+  |> filter(fn: (r) =>
+      r["_measurement"] == "{MEAS_ENV}" or
+      r["_measurement"] == "{MEAS_BIO}" or
+      r["_measurement"] == "{MEAS_LOC}"
+  )
+  |> filter(fn: (r) => {FIELD_FILTER})
+  |> aggregateWindow(every: 1s, fn: last, createEmpty: false)
+  |> to(bucket: "{LATEST_BUCKET}", org: "{INFLUX_ORG}")
+'''
+
+
+def ensure_latest_rollup() -> None:
+    """Create the LATEST_BUCKET bucket and its rollup task if missing (blocking, idempotent)."""
+    if LATEST_BUCKET == INFLUX_BUCKET:
+        return
+    get_query_api()
+    try:
+        buckets = _INFLUX.buckets_api()
+        if buckets.find_bucket_by_name(LATEST_BUCKET) is None:
+            buckets.create_bucket(
+                bucket_name=LATEST_BUCKET,
+                org=INFLUX_ORG,
+                retention_rules=BucketRetentionRules(type="expire", every_seconds=LATEST_ROLLUP_RETENTION_SEC),
+            )
+        tasks = _INFLUX.tasks_api()
+        if not tasks.find_tasks(name=LATEST_ROLLUP_TASK):
+            tasks.create_task(task_create_request=TaskCreateRequest(
+                flux=_FLUX_ROLLUP, org=INFLUX_ORG, status="active",
+                description=f"last() per second of {INFLUX_BUCKET} into {LATEST_BUCKET}",
+            ))
+    except Exception as e:
+        log.warning("could not set up rollup bucket %s: %s", LATEST_BUCKET, e)
+
+
+def flux_params(team: str, minutes: int) -> Dict[str, Any]:
+    """params.team / params.range bindings for the team-scoped queries."""
+    return {"team": team, "range": f"-{minutes}m"}
+
+
+def latest_members(team: str, minutes: int) -> Dict[str, Dict[str, Any]]:
+    """Last value of every WANTED_FIELDS field per FF of `team`, keyed by ffId (blocking)."""
+    members: Dict[str, Dict[str, Any]] = {}
+
+    try:
+        # records are parsed as the CSV arrives; no FluxTable list is built
+        for rec in get_query_api().query_stream(_FLUX_LATEST, org=INFLUX_ORG,
+                                                  params=flux_params(team, minutes)):
+            vals = rec.values
+            ff = vals.get("ffId")
+            if not ff:
+                continue
+
+            m = members.get(ff)
+            if m is None:
+                m = members[ff] = {"teamId": team, "ffId": ff, **EMPTY_MEMBER}
+            if vals.get("result") == "times":
+                t = vals.get("_time")
+                if t:
+                    m["observedAt"] = iso(t)
+                continue
+
+            for f in WANTED_FIELDS:
+                fval = coerce(vals.get(f))
+                if fval is not None:
+                    m[f] = fval
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(502, f"Influx query failed: {type(e).__name__}: {str(e)[:200]}")
+
+    return members
+
+
+# (team, minutes) -> (monotonic ts, members); one lock per key so a burst runs one query.
+# _LATEST_GUARD covers every insert/delete on both dicts.
+_LATEST_CACHE: Dict[Tuple[str, int], Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+_LATEST_LOCKS: Dict[Tuple[str, int], threading.Lock] = {}
+_LATEST_GUARD = threading.Lock()
+
+
+def _latest_lock(key: Tuple[str, int]) -> threading.Lock:
+    with _LATEST_GUARD:
+        lock = _LATEST_LOCKS.get(key)
+        if lock is None:
+            lock = _LATEST_LOCKS[key] = threading.Lock()
+        return lock
+
+
+def _prune_latest_cache() -> None:
+    """Drop expired entries, then the oldest live ones, down to LATEST_CACHE_MAX (holds _LATEST_GUARD)."""
+    cutoff = time.monotonic() - LATEST_CACHE_TTL_SEC
+    for k in [k for k, (ts, _) in _LATEST_CACHE.items() if ts <= cutoff]:
+        del _LATEST_CACHE[k]
+    excess = len(_LATEST_CACHE) - LATEST_CACHE_MAX
+    if excess > 0:
+        for k in sorted(_LATEST_CACHE, key=lambda k: _LATEST_CACHE[k][0])[:excess]:
+            del _LATEST_CACHE[k]
+    # a lock whose entry is gone only costs a duplicate query if it is still held
+    for k in [k for k in _LATEST_LOCKS if k not in _LATEST_CACHE]:
+        del _LATEST_LOCKS[k]
+
+
+def latest_members_cached(team: str, minutes: int) -> Dict[str, Dict[str, Any]]:
+    """
+    latest_members() behind a short TTL cache of at most LATEST_CACHE_MAX keys;
+    concurrent pollers of the same (team, minutes) share one query. Returns
+    per-FF copies the caller may mutate.
+    """
+    key = (team, minutes)
+    hit = _LATEST_CACHE.get(key)
+    if hit is None or hit[0] <= time.monotonic() - LATEST_CACHE_TTL_SEC:
+        with _latest_lock(key):
+            hit = _LATEST_CACHE.get(key)
+            if hit is None or hit[0] <= time.monotonic() - LATEST_CACHE_TTL_SEC:
+                hit = (time.monotonic(), latest_members(team, minutes))
+                with _LATEST_GUARD:
+                    _LATEST_CACHE[key] = hit
+                    if len(_LATEST_CACHE) > LATEST_CACHE_MAX or len(_LATEST_LOCKS) > LATEST_CACHE_MAX:
+                        _prune_latest_cache()
+    return {ff: dict(m) for ff, m in hit[1].items()}
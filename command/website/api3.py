@@ -1,28 +1,65 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
+import io
 import json
+import logging
 import os
 import time
-from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional, List, Tuple
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, List, Set, Tuple
+
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from influxdb_client import Dialect
+
+from _common import (
+    INFLUX_BUCKET,
+    INFLUX_ORG,
+    INFLUX_TOKEN,
+    aclose_http,
+    close_influx,
+    ensure_latest_rollup,
+    etag_json,
+    flux_params,
+    get_query_api,
+    http_client,
+    iso,
+    latest_members_cached,
+    need_influx,
+    now_utc,
+    safe_float,
+)
 
-import requests
-from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
-from influxdb_client import InfluxDBClient
+try:
+    import aiomqtt
+except Exception:  # pragma: no cover
+    aiomqtt = None
+
+try:
+    import pyarrow.csv as pa_csv
+except Exception:  # pragma: no cover
+    pa_csv = None
 
 try:
-    import paho.mqtt.client as mqtt
+    import orjson
+    from fastapi.responses import ORJSONResponse
 except Exception:  # pragma: no cover
-    mqtt = None
+    orjson = None
+
+if orjson is not None:
+    _loads = orjson.loads  # parses bytes directly, no decode step
+    app = FastAPI(default_response_class=ORJSONResponse)
+else:  # pragma: no cover
+    def _loads(b: bytes):
+        return json.loads(b.decode("utf-8", "replace"))
+    app = FastAPI()
 
-app = FastAPI()
+log = logging.getLogger("command-api")
 
 # ---- ENV ----
-INFLUX_URL = os.getenv("INFLUX_URL", "http://influxdb:8086")
-INFLUX_TOKEN = os.getenv("INFLUX_TOKEN", "")
-INFLUX_ORG = os.getenv("INFLUX_ORG", "")
-INFLUX_BUCKET = os.getenv("INFLUX_BUCKET", "")
+# Influx settings and MEAS_ENV/MEAS_BIO/MEAS_LOC live in _common.py
 
 # Orion inside Docker doesn't resolve in your setup; default to host IP that works for you.
 ORION_BASE = os.getenv("ORION_BASE", "http://192.168.2.12:1026")
@@ -32,53 +69,49 @@ WEATHER_ENTITY_ID = os.getenv("WEATHER_ENTITY_ID", "Weather:Patra")
 MQTT_HOST = os.getenv("MQTT_HOST", "192.168.2.12")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 
+# /ws/ecg: bundles received within this window go out as one WebSocket frame
+ECG_BATCH_SEC = float(os.getenv("ECG_BATCH_SEC", "0.02"))
+
 # Measurements (Influx)
-MEAS_ENV = os.getenv("MEAS_ENV", "Environment")
-MEAS_BIO = os.getenv("MEAS_BIO", "Biomedical")
-MEAS_LOC = os.getenv("MEAS_LOC", "Location")
 MEAS_ALERTS = os.getenv("MEAS_ALERTS", "Alerts")
 MEAS_WEATHER = os.getenv("MEAS_WEATHER", "WeatherObserved")
 
 # Location cache behavior
 LOC_CACHE_TTL_SEC = int(os.getenv("LOC_CACHE_TTL_SEC", "3600"))  # keep last known for 1h by default
 
+# /api/weather: Orion and Influx are raced; the winning answer is cached
+WEATHER_CACHE_TTL_SEC = float(os.getenv("WEATHER_CACHE_TTL_SEC", "30"))
+WEATHER_RACE_TIMEOUT_SEC = float(os.getenv("WEATHER_RACE_TIMEOUT_SEC", "3.5"))
 
-def _now_utc() -> datetime:
-    return datetime.now(timezone.utc)
-
-
-def _iso(dt: datetime) -> str:
-    return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
-
-
-def _safe_float(x) -> Optional[float]:
-    try:
-        if x is None:
-            return None
-        return float(x)
-    except Exception:
-        return None
 
+# -----------------------------------------------------------------------------
+# LIVE MQTT (one asyncio client): LOCATION CACHE + ECG FAN-OUT
+# -----------------------------------------------------------------------------
+# Keyed by teamId -> ffId -> {"lat": float, "lon": float, "observedAt": str, "ts": float}
+# (grouped by team so /api/latest only walks the requested team's FFs)
+_location_cache: Dict[str, Dict[str, Dict[str, Any]]] = {}
 
-def _need_influx():
-    if not (INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET):
-        raise HTTPException(500, "Missing INFLUX_TOKEN/INFLUX_ORG/INFLUX_BUCKET in environment")
+# Min-heap of (expires_at, teamId, ffId), one entry per cached FF; prune only touches the top
+_loc_expiry: List[Tuple[float, str, str]] = []
 
+class _EcgSub:
+    """One /ws/ecg connection: bounded buffer (full append drops the oldest) + wake-up event."""
+    __slots__ = ("buf", "evt")
 
-def _influx_client() -> InfluxDBClient:
-    _need_influx()
-    return InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
+    def __init__(self, maxlen: int = 50):
+        self.buf: deque = deque(maxlen=maxlen)
+        self.evt = asyncio.Event()
 
 
-# -----------------------------------------------------------------------------
-# LIVE MQTT LOCATION CACHE
-# -----------------------------------------------------------------------------
-# Keyed by (teamId, ffId) -> {"lat": float, "lon": float, "observedAt": str, "ts": float}
-_location_cache: Dict[Tuple[str, str], Dict[str, Any]] = {}
-_location_lock = asyncio.Lock()
+# Keyed by (teamId, ffId) -> /ws/ecg connections watching that FF. raw/ECG/<team>/<ff>
+# is subscribed only while its key is here, so idle workers don't pull ECG traffic.
+_ECG_FANOUT: Dict[Tuple[str, str], Set[_EcgSub]] = {}
 
-_mqtt_loc_client = None
-_mqtt_loc_loop = None
+_mqtt_task: Optional[asyncio.Task] = None
+_mqtt_client = None  # the connected aiomqtt.Client, None while (re)connecting
+MQTT_RECONNECT_SEC = 3
+_loc_prune_task: Optional[asyncio.Task] = None
+LOC_PRUNE_EVERY_SEC = 60
 
 
 def _parse_team_ff_from_topic(topic: str) -> Tuple[Optional[str], Optional[str]]:
@@ -100,12 +133,14 @@ def _payload_to_latlon(payload: bytes) -> Tuple[Optional[float], Optional[float]
       {"observedAt":"...Z"} etc.
     """
     try:
-        d = json.loads(payload.decode("utf-8", "replace"))
+        d = _loads(payload)
     except Exception:
         return None, None, None
+    if not isinstance(d, dict):
+        return None, None, None
 
-    lat = _safe_float(d.get("lat"))
-    lon = _safe_float(d.get("lon") if "lon" in d else d.get("lng"))
+    lat = safe_float(d.get("lat"))
+    lon = safe_float(d.get("lon") if "lon" in d else d.get("lng"))
 
     obs = None
     if isinstance(d.get("observedAt"), str) and d.get("observedAt"):
@@ -115,7 +150,7 @@ def _payload_to_latlon(payload: bytes) -> Tuple[Optional[float], Optional[float]
     elif isinstance(d.get("tst"), (int, float)):
         # OwnTracks 'tst' is epoch seconds
         try:
-            obs = _iso(datetime.fromtimestamp(float(d["tst"]), tz=timezone.utc))
+            obs = iso(datetime.fromtimestamp(float(d["tst"]), tz=timezone.utc))
         except Exception:
             obs = None
 
@@ -123,15 +158,18 @@ def _payload_to_latlon(payload: bytes) -> Tuple[Optional[float], Optional[float]
 
 
 def _cache_set(team: str, ff: str, lat: float, lon: float, observed_at: Optional[str]) -> None:
-    # Called from MQTT thread via loop.call_soon_threadsafe, so do not use await here.
-    key = (team, ff)
-    _location_cache[key] = {
+    # Called from the MQTT dispatch task on the event loop.
+    by_ff = _location_cache.setdefault(team, {})
+    now_ts = time.time()
+    if ff not in by_ff:
+        heapq.heappush(_loc_expiry, (now_ts + max(10, LOC_CACHE_TTL_SEC), team, ff))
+    by_ff[ff] = {
         "teamId": team,
         "ffId": ff,
         "lat": float(lat),
         "lon": float(lon),
-        "observedAt": observed_at or _iso(_now_utc()),
-        "ts": time.time(),
+        "observedAt": observed_at or iso(now_utc()),
+        "ts": now_ts,
         "source": "mqtt",
     }
 
@@ -139,86 +177,133 @@ def _cache_set(team: str, ff: str, lat: float, lon: float, observed_at: Optional
 def _cache_prune(now_ts: Optional[float] = None) -> None:
     now_ts = now_ts or time.time()
     ttl = max(10, LOC_CACHE_TTL_SEC)
-    dead = [k for k, v in _location_cache.items() if (now_ts - float(v.get("ts", 0))) > ttl]
-    for k in dead:
-        _location_cache.pop(k, None)
-
-
-def _start_mqtt_location_cache():
-    """
-    Starts a background MQTT client (threaded via paho loop_start)
-    that subscribes to ngsi/Location/+/+ and keeps last lat/lon per FF.
-    """
-    global _mqtt_loc_client, _mqtt_loc_loop
-    if mqtt is None:
-        return
-    if _mqtt_loc_client is not None:
-        return
-
-    _mqtt_loc_loop = asyncio.get_event_loop()
-
-    client = mqtt.Client()
-
-    def on_connect(c, userdata, flags, rc):
-        if rc == 0:
-            c.subscribe("ngsi/Location/+/+", qos=0)
+    while _loc_expiry and _loc_expiry[0][0] <= now_ts:
+        _, team, ff = heapq.heappop(_loc_expiry)
+        by_ff = _location_cache.get(team)
+        rec = by_ff.get(ff) if by_ff else None
+        if rec is None:
+            continue
+        expires = float(rec.get("ts", 0)) + ttl
+        if expires > now_ts:
+            # refreshed since it was queued: re-arm at its current expiry
+            heapq.heappush(_loc_expiry, (expires, team, ff))
+            continue
+        del by_ff[ff]
+        if not by_ff:
+            _location_cache.pop(team, None)
+
+
+def _ecg_topic(key: Tuple[str, str]) -> str:
+    return f"raw/ECG/{key[0]}/{key[1]}"
+
+
+async def _ecg_subscribe(key: Tuple[str, str]) -> None:
+    # while disconnected there is nothing to do: _mqtt_dispatch subscribes every
+    # _ECG_FANOUT key when it reconnects
+    if _mqtt_client is not None:
+        try:
+            await _mqtt_client.subscribe(_ecg_topic(key), 0)
+        except Exception:
+            pass
 
-    def on_message(c, userdata, msg):
-        topic = msg.topic or ""
-        team, ff = _parse_team_ff_from_topic(topic)
-        if not team or not ff:
-            return
 
-        lat, lon, obs = _payload_to_latlon(bytes(msg.payload))
-        if lat is None or lon is None:
-            return
+async def _ecg_unsubscribe(key: Tuple[str, str]) -> None:
+    if _mqtt_client is not None:
+        try:
+            await _mqtt_client.unsubscribe(_ecg_topic(key))
+        except Exception:
+            pass
 
-        def _apply():
-            try:
-                _cache_prune()
-                _cache_set(team, ff, lat, lon, obs)
-            except Exception:
-                pass
 
-        # marshal into the FastAPI loop safely
+async def _mqtt_dispatch():
+    """
+    Single asyncio MQTT client for the whole API (reconnects on failure):
+      ngsi/Location/<team>/<ff> -> _location_cache
+      raw/ECG/<team>/<ff>       -> every subscriber registered in _ECG_FANOUT
+    """
+    global _mqtt_client
+    while True:
         try:
-            _mqtt_loc_loop.call_soon_threadsafe(_apply)
+            async with aiomqtt.Client(MQTT_HOST, MQTT_PORT, keepalive=30) as client:
+                # no await between the snapshot and publishing the client, so a viewer
+                # either is in the snapshot or subscribes itself through _ecg_subscribe
+                topics = [("ngsi/Location/+/+", 0)] + [(_ecg_topic(k), 0) for k in _ECG_FANOUT]
+                _mqtt_client = client
+                await client.subscribe(topics)
+                async for msg in client.messages:
+                    topic = msg.topic.value
+                    if topic.startswith("raw/ECG/"):
+                        parts = topic.split("/")
+                        subs = _ECG_FANOUT.get((parts[2], parts[3])) if len(parts) >= 4 else None
+                        if subs:
+                            payload = bytes(msg.payload)
+                            for sub in subs:
+                                sub.buf.append(payload)
+                                sub.evt.set()
+                        continue
+
+                    team, ff = _parse_team_ff_from_topic(topic)
+                    if not team or not ff:
+                        continue
+                    lat, lon, obs = _payload_to_latlon(bytes(msg.payload))
+                    if lat is None or lon is None:
+                        continue
+                    _cache_set(team, ff, lat, lon, obs)
+        except asyncio.CancelledError:
+            _mqtt_client = None
+            raise
         except Exception:
-            # if loop isn't available, still store (best effort)
-            try:
-                _cache_prune()
-                _cache_set(team, ff, lat, lon, obs)
-            except Exception:
-                pass
+            _mqtt_client = None
+            await asyncio.sleep(MQTT_RECONNECT_SEC)
 
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.connect(MQTT_HOST, MQTT_PORT, keepalive=30)
-    client.loop_start()
 
-    _mqtt_loc_client = client
+async def _loc_prune_loop():
+    while True:
+        await asyncio.sleep(LOC_PRUNE_EVERY_SEC)
+        try:
+            _cache_prune()
+        except Exception:
+            pass
 
 
 @app.on_event("startup")
 async def _on_startup():
-    # Start MQTT location cache so /api/latest can always provide last-known coords.
-    try:
-        _start_mqtt_location_cache()
-    except Exception:
-        # don't fail startup if mqtt isn't reachable
-        pass
+    global _loc_prune_task, _mqtt_task
+    if INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET:
+        get_query_api()
+        await asyncio.to_thread(ensure_latest_rollup)
+    http_client()
+
+    # One MQTT connection feeds the location cache (/api/latest) and every /ws/ecg client.
+    # The task retries in the background, so startup doesn't fail if mqtt isn't reachable.
+    if aiomqtt is not None:
+        _mqtt_task = asyncio.create_task(_mqtt_dispatch())
+    _loc_prune_task = asyncio.create_task(_loc_prune_loop())
+    _action_queue()
 
 
 @app.on_event("shutdown")
 async def _on_shutdown():
-    global _mqtt_loc_client
-    try:
-        if _mqtt_loc_client is not None:
-            _mqtt_loc_client.loop_stop()
-            _mqtt_loc_client.disconnect()
-    except Exception:
-        pass
-    _mqtt_loc_client = None
+    global _mqtt_task, _loc_prune_task, _action_task
+    # give queued actions a few seconds to reach Orion before the HTTP client closes
+    if _ACTION_Q is not None and _action_task is not None:
+        try:
+            await asyncio.wait_for(_ACTION_Q.join(), timeout=5)
+        except asyncio.TimeoutError:
+            log.warning("shutdown with %d actions still queued", _ACTION_Q.qsize())
+        _action_task.cancel()
+        _action_task = None
+
+    if _loc_prune_task is not None:
+        _loc_prune_task.cancel()
+        _loc_prune_task = None
+
+    if _mqtt_task is not None:
+        _mqtt_task.cancel()
+        _mqtt_task = None
+
+    close_influx()
+    await aclose_http()
 
 
 # -----------------------------------------------------------------------------
@@ -226,14 +311,28 @@ async def _on_shutdown():
 # -----------------------------------------------------------------------------
 @app.get("/api/health")
 def health():
-    return {"ok": True, "ts": _iso(_now_utc())}
+    return {"ok": True, "ts": iso(now_utc())}
+
+
+_FLUX_ALERTS = f'''
+from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: duration(v: params.range))
+  |> filter(fn: (r) => r["_measurement"] == "{MEAS_ALERTS}")
+  |> filter(fn: (r) => r["teamId"] == params.team)
+  |> keep(columns: ["_time","_field","_value","ffId","teamId"])
+  |> pivot(rowKey: ["_time","ffId"], columnKey: ["_field"], valueColumn: "_value")
+  |> group()
+  |> sort(columns: ["_time"], desc: true)
+  |> limit(n: params.limit)
+'''
 
 
 @app.get("/api/latest")
-def latest(team: str = Query(...), minutes: int = Query(60, ge=1, le=240)):
+async def latest(request: Request, team: str = Query(...), minutes: int = Query(60, ge=1, le=240)):
     """
     Returns:
       { team: "Team_A", members: [ {teamId, ffId, hrBpm, tempC, mq2Raw, lat, lon, ...}, ... ] }
+    with an ETag; a matching If-None-Match gets 304 and no body.
 
     Primary source: Influx points tagged with teamId, ffId across
       Environment / Biomedical / Location.
@@ -243,67 +342,15 @@ def latest(team: str = Query(...), minutes: int = Query(60, ge=1, le=240)):
       we merge last-known coords from MQTT topic cache:
         ngsi/Location/<team>/<ff>
     """
-    _need_influx()
-
-    since = _now_utc() - timedelta(minutes=minutes)
-    start = since.isoformat()
-
-    wanted_fields = [
-        "hrBpm", "rrMs",
-        "tempC", "humidityPct", "mq2Raw", "mq2Digital", "coPpm",
-        "stressIndex", "fatigueIndex", "riskScore",
-        "heatRisk", "heatIndexC", "gasRisk", "separationRisk",
-        "rmssdMs", "sdnnMs", "pnn50Pct",
-        "lat", "lon",
-    ]
-    field_filter = " or ".join([f'r["_field"] == "{f}"' for f in wanted_fields])
-
-    flux = f'''
-from(bucket: "{INFLUX_BUCKET}")
-  |> range(start: {start})
-  |> filter(fn: (r) => r["teamId"] == "{team}")
-  |> filter(fn: (r) =>
-      r["_measurement"] == "{MEAS_ENV}" or
-      r["_measurement"] == "{MEAS_BIO}" or
-      r["_measurement"] == "{MEAS_LOC}"
-  )
-  |> filter(fn: (r) => {field_filter})
-  |> keep(columns: ["_time","_measurement","_field","_value","ffId","teamId"])
-  |> sort(columns: ["_time"], desc: false)
-'''
-
-    members: Dict[str, Dict[str, Any]] = {}
-
-    try:
-        with _influx_client() as client:
-            q = client.query_api()
-            tables = q.query(flux, org=INFLUX_ORG)
-    except Exception as e:
-        raise HTTPException(502, f"Influx query failed: {type(e).__name__}: {str(e)[:200]}")
-
-    for table in tables:
-        for rec in table.records:
-            ff = rec.values.get("ffId")
-            if not ff:
-                continue
-
-            m = members.setdefault(ff, {"teamId": team, "ffId": ff})
-            field = rec.get_field()
-            val = rec.get_value()
-            t = rec.get_time()
-            if t:
-                m["observedAt"] = _iso(t)
-
-            fval = _safe_float(val)
-            if fval is None:
-                continue
-            m[field] = fval
+    need_influx()
+    members = await asyncio.to_thread(latest_members_cached, team, minutes)
 
     # ---- Merge MQTT cached locations (fixes FF_A missing lat/lon) ----
     try:
-        _cache_prune()
-        for (t, ff), v in list(_location_cache.items()):
-            if t != team:
+        # the background prune runs every minute; skip anything already past TTL
+        cutoff = time.time() - max(10, LOC_CACHE_TTL_SEC)
+        for ff, v in _location_cache.get(team, {}).items():
+            if float(v.get("ts", 0)) < cutoff:
                 continue
 
             m = members.setdefault(ff, {"teamId": team, "ffId": ff})
@@ -315,12 +362,13 @@ from(bucket: "{INFLUX_BUCKET}")
             if not lat_ok or not lon_ok:
                 m["lat"] = float(v.get("lat"))
                 m["lon"] = float(v.get("lon"))
-                m["locObservedAt"] = v.get("observedAt") or _iso(_now_utc())
+                m["locObservedAt"] = v.get("observedAt") or iso(now_utc())
                 m["locSource"] = "mqtt"
     except Exception:
         pass
 
-    return {"team": team, "members": list(members.values())}
+    # plain dicts of str/float/None: encoded once here, so FastAPI skips jsonable_encoder
+    return etag_json(request, {"team": team, "members": list(members.values())})
 
 
 def _weather_risk_from_wind(wind_ms: Optional[float]) -> str:
@@ -333,47 +381,7 @@ def _weather_risk_from_wind(wind_ms: Optional[float]) -> str:
     return "LOW"
 
 
-@app.get("/api/weather")
-def weather(lat: float = Query(...), lon: float = Query(...)):
-    """
-    Prefer ORION (because your agent updates Orion reliably).
-    If ORION fails, optionally try Influx WeatherObserved.
-    """
-    # 1) ORION (primary)
-    try:
-        r = requests.get(
-            f"{ORION_BASE}/v2/entities/{WEATHER_ENTITY_ID}",
-            params={"options": "keyValues"},
-            timeout=3,
-        )
-        if r.status_code == 200:
-            d = r.json() or {}
-            temp_c = _safe_float(d.get("temperature"))
-            wind_ms = _safe_float(d.get("windSpeed"))
-            wind_dir = _safe_float(d.get("windDirection"))
-            hum = _safe_float(d.get("humidity"))
-            obs = d.get("timestamp") or d.get("observedAt")
-
-            out = {"ok": True, "source": "orion", "risk": _weather_risk_from_wind(wind_ms)}
-            if temp_c is not None:
-                out["tempC"] = temp_c
-            if wind_ms is not None:
-                out["windMs"] = wind_ms
-            if wind_dir is not None:
-                out["windDirDeg"] = wind_dir
-            if hum is not None:
-                out["humidityPct"] = hum
-            if isinstance(obs, str) and obs:
-                out["observedAt"] = obs
-            return out
-    except Exception:
-        pass
-
-    # 2) Influx fallback (best-effort)
-    if not (INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET):
-        return {"ok": False, "reason": "Weather fetch failed: Orion unreachable + missing Influx env", "risk": "LOW"}
-
-    flux = f"""from(bucket: "{INFLUX_BUCKET}")
+_FLUX_WEATHER = f"""from(bucket: "{INFLUX_BUCKET}")
   |> range(start: -6h)
   |> filter(fn: (r) => r["_measurement"] == "{MEAS_WEATHER}")
   |> filter(fn: (r) =>
@@ -388,11 +396,59 @@ def weather(lat: float = Query(...), lon: float = Query(...)):
   |> sort(columns: ["_time"], desc: true)
   |> limit(n: 1)
 """
+
+# last good /api/weather answer: (monotonic ts, payload); single entity, so no key
+_weather_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+
+
+def _weather_out(source: str, temp_c, wind_ms, wind_dir, hum, observed_at) -> Dict[str, Any]:
+    out = {"ok": True, "source": source, "risk": _weather_risk_from_wind(wind_ms)}
+    if temp_c is not None:
+        out["tempC"] = temp_c
+    if wind_ms is not None:
+        out["windMs"] = wind_ms
+    if wind_dir is not None:
+        out["windDirDeg"] = wind_dir
+    if hum is not None:
+        out["humidityPct"] = hum
+    if observed_at:
+        out["observedAt"] = observed_at
+    return out
+
+
+async def _fetch_orion_weather() -> Tuple[Optional[Dict[str, Any]], str]:
+    try:
+        r = await http_client().get(
+            f"{ORION_BASE}/v2/entities/{WEATHER_ENTITY_ID}",
+            params={"options": "keyValues"},
+            timeout=3,
+        )
+    except Exception as e:
+        return None, f"Orion unreachable: {type(e).__name__}"
+    if r.status_code != 200:
+        return None, f"Orion error: {r.status_code}"
+    try:
+        d = r.json() or {}
+    except ValueError:
+        return None, "Orion returned invalid JSON"
+    obs = d.get("timestamp") or d.get("observedAt")
+    return _weather_out(
+        "orion",
+        safe_float(d.get("temperature")),
+        safe_float(d.get("windSpeed")),
+        safe_float(d.get("windDirection")),
+        safe_float(d.get("humidity")),
+        obs if isinstance(obs, str) else None,
+    ), ""
+
+
+async def _fetch_influx_weather() -> Tuple[Optional[Dict[str, Any]], str]:
+    if not (INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET):
+        return None, "Weather fetch failed: Orion unreachable + missing Influx env"
     try:
-        with InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG) as client:
-            tables = client.query_api().query(flux, org=INFLUX_ORG)
+        tables = await asyncio.to_thread(get_query_api().query, _FLUX_WEATHER, INFLUX_ORG)
     except Exception as e:
-        return {"ok": False, "reason": f"Weather fetch failed: {type(e).__name__}", "risk": "LOW"}
+        return None, f"Weather fetch failed: {type(e).__name__}"
 
     row = None
     for t in tables:
@@ -403,36 +459,125 @@ def weather(lat: float = Query(...), lon: float = Query(...)):
             break
 
     if not row:
-        return {"ok": False, "reason": "No weather data (Orion failed, Influx empty)", "risk": "LOW"}
+        return None, "No weather data (Orion failed, Influx empty)"
 
-    temp_c = _safe_float(row.get("temperature"))
-    wind_ms = _safe_float(row.get("windSpeed"))
-    wind_dir = _safe_float(row.get("windDirection"))
-    hum = _safe_float(row.get("humidityPct"))
+    hum = safe_float(row.get("humidityPct"))
     if hum is None:
-        hum = _safe_float(row.get("humidity"))
-
-    observed_at = None
+        hum = safe_float(row.get("humidity"))
     t = row.get("_time")
-    if isinstance(t, datetime):
-        observed_at = _iso(t)
+    return _weather_out(
+        "influx",
+        safe_float(row.get("temperature")),
+        safe_float(row.get("windSpeed")),
+        safe_float(row.get("windDirection")),
+        hum,
+        iso(t) if isinstance(t, datetime) else None,
+    ), ""
 
-    out = {"ok": True, "source": "influx", "risk": _weather_risk_from_wind(wind_ms)}
-    if temp_c is not None:
-        out["tempC"] = temp_c
-    if wind_ms is not None:
-        out["windMs"] = wind_ms
-    if wind_dir is not None:
-        out["windDirDeg"] = wind_dir
-    if hum is not None:
-        out["humidityPct"] = hum
-    if observed_at:
-        out["observedAt"] = observed_at
-    return out
+
+def _weather_usable(out: Optional[Dict[str, Any]]) -> bool:
+    return bool(out) and ("tempC" in out or "windMs" in out)
+
+
+@app.get("/api/weather")
+async def weather(lat: float = Query(...), lon: float = Query(...)):
+    """
+    Orion (primary, your agent updates it reliably) and Influx WeatherObserved are
+    raced; the first usable answer wins (Orion if both are ready) and is cached
+    for WEATHER_CACHE_TTL_SEC.
+    """
+    global _weather_cache
+    now = time.monotonic()
+    if _weather_cache is not None and now - _weather_cache[0] < WEATHER_CACHE_TTL_SEC:
+        return _weather_cache[1]
+
+    orion_task = asyncio.create_task(_fetch_orion_weather())
+    influx_task = asyncio.create_task(_fetch_influx_weather())
+    pending = {orion_task, influx_task}
+    deadline = now + WEATHER_RACE_TIMEOUT_SEC
+    best: Optional[Dict[str, Any]] = None
+
+    try:
+        while pending and best is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in (orion_task, influx_task):
+                if task in done and best is None:
+                    out, _ = task.result()
+                    if _weather_usable(out):
+                        best = out
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if best is not None:
+        _weather_cache = (time.monotonic(), best)
+        return best
+
+    # nothing usable in time: return any partial answer, else the last failure reason
+    reason = "Weather fetch failed: timeout"
+    for task in (orion_task, influx_task):
+        if task.done() and not task.cancelled():
+            out, why = task.result()
+            if out is not None:
+                return out
+            reason = why or reason
+    return {"ok": False, "reason": reason, "risk": "LOW"}
+
+
+_ACTION_Q: Optional[asyncio.Queue] = None
+_action_task: Optional[asyncio.Task] = None
+ACTION_MAX_ATTEMPTS = 5
+# one worker drains the queue; past this many pending actions /api/action answers 503
+ACTION_QUEUE_MAX = int(os.getenv("ACTION_QUEUE_MAX", "1000"))
+
+
+def _action_queue() -> asyncio.Queue:
+    global _ACTION_Q, _action_task
+    if _ACTION_Q is None:
+        _ACTION_Q = asyncio.Queue(maxsize=ACTION_QUEUE_MAX)
+    if _action_task is None:
+        _action_task = asyncio.create_task(_action_worker())
+    return _ACTION_Q
+
+
+async def _action_worker():
+    """
+    Drains queued CommandAction entities into Orion. Transport errors and 5xx are
+    retried with exponential backoff; a 4xx is Orion rejecting the entity, so it is
+    dropped at once.
+    """
+    q = _ACTION_Q
+    while True:
+        ent = await q.get()
+        try:
+            for attempt in range(ACTION_MAX_ATTEMPTS):
+                try:
+                    r = await http_client().post(
+                        f"{ORION_BASE}/v2/op/update",
+                        json={"actionType": "append", "entities": [ent]},
+                        timeout=5,
+                    )
+                    if r.status_code in (200, 201, 204):
+                        break
+                    err = f"{r.status_code} {r.text[:200]}"
+                    if 400 <= r.status_code < 500:
+                        log.warning("Orion rejected action %s: %s", ent.get("id"), err)
+                        break
+                except Exception as e:
+                    err = f"{type(e).__name__}: {e}"
+                if attempt + 1 < ACTION_MAX_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
+            else:
+                log.warning("dropping action %s after %d attempts: %s", ent.get("id"), ACTION_MAX_ATTEMPTS, err)
+        finally:
+            q.task_done()
 
 
-@app.post("/api/action")
-def action(payload: Dict[str, Any]):
+@app.post("/api/action", status_code=202)
+async def action(payload: Dict[str, Any]):
     """
     Stores a command action to Orion.
     payload: {teamId, ffId?, action, note?}
@@ -453,27 +598,20 @@ def action(payload: Dict[str, Any]):
         "ffId": {"type": "Text", "value": ff},
         "action": {"type": "Text", "value": str(action_name)},
         "note": {"type": "Text", "value": str(note)[:500]},
-        "observedAt": {"type": "Text", "value": _iso(_now_utc())},
+        "observedAt": {"type": "Text", "value": iso(now_utc())},
         "timestamp": {"type": "Number", "value": ts},
     }
 
+    # Orion write happens in _action_worker; the id is final, so answer right away
     try:
-        r = requests.post(
-            f"{ORION_BASE}/v2/op/update",
-            json={"actionType": "append", "entities": [ent]},
-            timeout=5,
-        )
-    except Exception as e:
-        raise HTTPException(502, f"Orion unreachable: {e}")
-
-    if r.status_code not in (200, 201, 204):
-        raise HTTPException(502, f"Orion error: {r.status_code} {r.text[:200]}")
-
-    return {"ok": True, "id": eid}
+        _action_queue().put_nowait(ent)
+    except asyncio.QueueFull:
+        raise HTTPException(503, "Action queue full, Orion is not keeping up")
+    return {"ok": True, "id": eid, "queued": True}
 
 
 @app.get("/api/actions")
-def actions(
+async def actions(
     team: str = Query(...),
     minutes: int = Query(180, ge=1, le=1440),
     limit: int = Query(200, ge=1, le=2000),
@@ -486,15 +624,17 @@ def actions(
     since_ts = int(time.time()) - int(minutes * 60)
 
     # Orion v2 supports filtering by type and q (simple comparisons).
-    # We store timestamp (Number) so we can filter on it.
+    # We store timestamp (Number) so we can filter and order on it server-side.
     try:
-        r = requests.get(
+        r = await http_client().get(
             f"{ORION_BASE}/v2/entities",
             params={
                 "type": "CommandAction",
                 "options": "keyValues",
                 "limit": str(min(limit, 1000)),
                 "q": f"teamId=={team};timestamp>{since_ts}",
+                "orderBy": "!timestamp",
+                "attrs": "teamId,ffId,action,note,observedAt,timestamp",
             },
             timeout=5,
         )
@@ -508,8 +648,6 @@ def actions(
     out: List[Dict[str, Any]] = []
     for e in arr:
         try:
-            if e.get("teamId") != team:
-                continue
             out.append(
                 {
                     "id": e.get("id"),
@@ -524,14 +662,60 @@ def actions(
         except Exception:
             pass
 
-    # sort newest first
-    out.sort(key=lambda x: int(x.get("timestamp") or 0), reverse=True)
+    # already newest first (orderBy); the slice is only a safety cap
     out = out[:limit]
     return {"team": team, "actions": out}
 
 
+_ALERT_META_COLS = frozenset({"", "result", "table", "_start", "_stop", "_time", "ffId", "teamId"})
+
+
+def _alert_row(team: str, ff, t, fields) -> Optional[Dict[str, Any]]:
+    if not isinstance(t, datetime):
+        return None
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    row: Dict[str, Any] = {"teamId": team, "ffId": ff or "", "observedAt": iso(t)}
+    for k, v in fields:
+        if v is None or k in _ALERT_META_COLS:
+            continue
+        row[k] = float(v) if isinstance(v, (int, float)) else str(v)
+    return row
+
+
+def _alert_rows(params: Dict[str, Any], team: str) -> List[Dict[str, Any]]:
+    """
+    One pivoted row per alert (newest first, already limited by Flux).
+    With pyarrow the CSV response is parsed columnar instead of building a FluxRecord per row.
+    """
+    q = get_query_api()
+    rows: List[Dict[str, Any]] = []
+
+    if pa_csv is not None:
+        resp = q.query_raw(_FLUX_ALERTS, org=INFLUX_ORG, params=params,
+                           dialect=Dialect(header=True, annotations=[]))
+        raw = resp.data if hasattr(resp, "data") else resp
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        if not raw.strip():
+            return rows
+        for d in pa_csv.read_csv(io.BytesIO(raw)).to_pylist():
+            r = _alert_row(team, d.get("ffId"), d.get("_time"), d.items())
+            if r is not None:
+                rows.append(r)
+        return rows
+
+    # records are parsed as the CSV arrives; no FluxTable list is built
+    for rec in q.query_stream(_FLUX_ALERTS, org=INFLUX_ORG, params=params):
+        vals = rec.values
+        r = _alert_row(team, vals.get("ffId"), vals.get("_time"), vals.items())
+        if r is not None:
+            rows.append(r)
+    return rows
+
+
 @app.get("/api/alerts")
-def alerts(
+async def alerts(
     team: str = Query(...),
     minutes: int = Query(180, ge=1, le=1440),
     limit: int = Query(200, ge=1, le=2000),
@@ -540,48 +724,14 @@ def alerts(
     Returns alerts from Influx (if you persist them).
     Expected tags: teamId, ffId.
     """
-    _need_influx()
-    since = _now_utc() - timedelta(minutes=minutes)
-    start = since.isoformat()
-
-    flux = f'''
-from(bucket: "{INFLUX_BUCKET}")
-  |> range(start: {start})
-  |> filter(fn: (r) => r["_measurement"] == "{MEAS_ALERTS}")
-  |> filter(fn: (r) => r["teamId"] == "{team}")
-  |> keep(columns: ["_time","_field","_value","ffId","teamId"])
-  |> sort(columns: ["_time"], desc: true)
-'''
-
-    acc: Dict[str, Dict[str, Any]] = {}
+    need_influx()
+    params = {**flux_params(team, minutes), "limit": limit}
 
     try:
-        with _influx_client() as client:
-            q = client.query_api()
-            tables = q.query(flux, org=INFLUX_ORG)
+        rows = await asyncio.to_thread(_alert_rows, params, team)
     except Exception as e:
         raise HTTPException(502, f"Influx query failed: {type(e).__name__}: {str(e)[:200]}")
 
-    for table in tables:
-        for rec in table.records:
-            ff = rec.values.get("ffId") or ""
-            t = rec.get_time()
-            if not t:
-                continue
-            k = f"{ff}|{t.isoformat()}"
-            row = acc.setdefault(k, {"teamId": team, "ffId": ff, "observedAt": _iso(t)})
-
-            field = rec.get_field()
-            val = rec.get_value()
-            if isinstance(val, (int, float)):
-                row[field] = float(val)
-            else:
-                row[field] = str(val)
-
-    rows: List[Dict[str, Any]] = list(acc.values())
-    rows.sort(key=lambda r: r.get("observedAt", ""), reverse=True)
-    rows = rows[:limit]
-
     for r in rows:
         if "severity" not in r and "worst" in r:
             r["severity"] = r.get("worst")
@@ -596,60 +746,60 @@ from(bucket: "{INFLUX_BUCKET}")
 # -----------------------------------------------------------------------------
 @app.websocket("/ws/ecg")
 async def ws_ecg(ws: WebSocket, team: str = Query(...), ff: str = Query(...)):
-    if mqtt is None:
-        await ws.accept()
-        await ws.send_text("ERROR: paho-mqtt not installed in api container")
+    """
+    Binary frames carry one or more ECG1 bundles, each prefixed with its length
+    as a 2-byte big-endian integer: [len][bundle][len][bundle]...
+    Bundles arriving within ECG_BATCH_SEC are coalesced into one frame.
+    An empty frame every 5 s is a keepalive.
+    """
+    await ws.accept()
+    if aiomqtt is None:
+        await ws.send_text("ERROR: aiomqtt not installed in api container")
         await ws.close()
         return
 
-    await ws.accept()
-
-    topic = f"raw/ECG/{team}/{ff}"
-    loop = asyncio.get_running_loop()
-    aq: asyncio.Queue[bytes] = asyncio.Queue(maxsize=50)
-
-    def on_connect(client, userdata, flags, rc):
-        if rc == 0:
-            client.subscribe(topic, qos=0)
-
-    def on_message(client, userdata, msg):
-        payload = bytes(msg.payload)
-
-        def _put():
-            try:
-                if aq.full():
-                    try:
-                        aq.get_nowait()
-                    except Exception:
-                        pass
-                aq.put_nowait(payload)
-            except Exception:
-                pass
-
-        loop.call_soon_threadsafe(_put)
+    # team/ff become an MQTT topic level: no wildcards or extra levels
+    if any(c in team + ff for c in "+#/") or not team or not ff:
+        await ws.send_text("ERROR: invalid team/ff")
+        await ws.close()
+        return
 
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.connect(MQTT_HOST, MQTT_PORT, keepalive=30)
-    client.loop_start()
+    # frames arrive via the shared MQTT dispatch task (see _mqtt_dispatch)
+    key = (team, ff)
+    sub = _EcgSub(maxlen=50)
+    subs = _ECG_FANOUT.get(key)
+    if subs is None:
+        subs = _ECG_FANOUT[key] = {sub}
+        await _ecg_subscribe(key)
+    else:
+        subs.add(sub)
 
     try:
         while True:
-            try:
-                payload = await asyncio.wait_for(aq.get(), timeout=5.0)
-                await ws.send_bytes(payload)
-            except asyncio.TimeoutError:
-                # keepalive tick so proxies don't kill idle WS
-                await ws.send_bytes(b"")
+            if not sub.buf:
+                try:
+                    await asyncio.wait_for(sub.evt.wait(), timeout=5.0)
+                except asyncio.TimeoutError:
+                    # keepalive tick so proxies don't kill idle WS
+                    await ws.send_bytes(b"")
+                    continue
+
+            # linger briefly, then drain everything buffered into one frame
+            await asyncio.sleep(ECG_BATCH_SEC)
+            sub.evt.clear()
+            out = bytearray()
+            while sub.buf:
+                p = sub.buf.popleft()
+                out += len(p).to_bytes(2, "big")
+                out += p
+            await ws.send_bytes(bytes(out))
     except WebSocketDisconnect:
         pass
     finally:
-        try:
-            client.loop_stop()
-            client.disconnect()
-        except Exception:
-            pass
+        subs.discard(sub)
+        if not subs and _ECG_FANOUT.get(key) is subs:
+            _ECG_FANOUT.pop(key, None)
+            await _ecg_unsubscribe(key)
         try:
             await ws.close()
         except Exception:
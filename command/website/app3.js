@@ -1397,12 +1397,16 @@ function ecgConnect(team, ff) {
     try {
       if (!ev.data || (ev.data instanceof ArrayBuffer && ev.data.byteLength === 0)) return;
       const u8 = new Uint8Array(ev.data);
-      const pkts = parseEcg1Bundle(u8);
-      if (!pkts.length) return;
-      for (const p of pkts) {
-        const parsed = parsePolarPmdEcg(p);
-        if (!parsed) continue;
-        ecgAppendSamples(parsed.samples, parsed.ts);
+      // frame = [u16 BE len][ECG1 bundle] repeated (server coalesces bundles)
+      for (let o = 0; o + 2 <= u8.length; ) {
+        const len = (u8[o] << 8) | u8[o + 1];
+        const bundle = u8.subarray(o + 2, o + 2 + len);
+        o += 2 + len;
+        for (const p of parseEcg1Bundle(bundle)) {
+          const parsed = parsePolarPmdEcg(p);
+          if (!parsed) continue;
+          ecgAppendSamples(parsed.samples, parsed.ts);
+        }
       }
     } catch (e) { console.warn(e); }
   };
@@ -13,14 +13,31 @@ NOT MEDICAL. Demo-only heuristics.
 
 from __future__ import annotations
 
+import json
 import os
 import math
 import time
-from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import requests
 from influxdb_client import InfluxDBClient
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+if orjson is not None:
+    _dumps = orjson.dumps
+else:  # pragma: no cover
+    def _dumps(o) -> bytes:
+        return json.dumps(o, separators=(",", ":")).encode("utf-8")
 
 
 # ----------------- ENV / CONFIG -----------------
@@ -34,10 +51,13 @@ ORION_UPDATE_URL = os.getenv("ORION_UPDATE_URL", f"{ORION_BASE}/v2/op/update")
 ORION_TIMEOUT = float(os.getenv("ORION_TIMEOUT", "5"))
 
 TEAM_ID = os.getenv("TEAM_ID", "Team_A")
+# comma-separated; all teams are read with one Flux query per tick
+TEAM_IDS = [t.strip() for t in os.getenv("TEAM_IDS", TEAM_ID).split(",") if t.strip()]
 LEADER_FF_ID = os.getenv("LEADER_FF_ID", "FF_A")
 
 POLL_SEC = float(os.getenv("POLL_SEC", "5"))
 LOOKBACK_MIN = int(os.getenv("LOOKBACK_MIN", "3"))  # recent window for RR + latest readings
+TICK_TIMEOUT_SEC = float(os.getenv("TICK_TIMEOUT_SEC", str(3 * POLL_SEC)))  # stop waiting on a hung tick
 
 # measurement names in Influx (your api.py uses these defaults)
 MEAS_ENV = os.getenv("MEAS_ENV", "Environment")
@@ -60,6 +80,15 @@ W_HEAT = float(os.getenv("W_HEAT", "0.20"))
 W_GAS = float(os.getenv("W_GAS", "0.10"))
 W_SEP = float(os.getenv("W_SEP", "0.10"))
 
+# normalisation scales, inverted once here so the per-FF math multiplies instead of divides
+_HR_RANGE_INV = 1.0 / max(1.0, HR_MAX_BPM - BASELINE_HR_BPM)
+_RMSSD_INV = 1.0 / max(1.0, BASELINE_RMSSD_MS)
+_PNN50_INV = 1.0 / 30.0        # pNN50 of 30 % counts as fully relaxed
+_HI_RANGE_INV = 1.0 / 14.0     # heat index 32 C -> 46 C
+_MQ2_RANGE_INV = 1.0 / 1400.0  # MQ-2 raw 1800 -> 3200
+_CO_RANGE_INV = 1.0 / 115.0    # CO 35 ppm -> 150 ppm
+_SEP_RANGE_INV = 1.0 / 80.0    # 60 m -> 140 m from the leader
+
 
 # ----------------- helpers -----------------
 def now_utc() -> datetime:
@@ -79,16 +108,18 @@ def safe_float(x) -> Optional[float]:
     except Exception:
         return None
 
-def haversine_m(lat1, lon1, lat2, lon2) -> float:
+def haversine_m_vec(lat1: np.ndarray, lon1: np.ndarray, lat2: float, lon2: float) -> np.ndarray:
+    # haversine distance in m from every (lat1[i], lon1[i]) to one point; NaN in -> NaN out
     R = 6371000.0
-    p1, p2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dl = math.radians(lon2 - lon1)
-    a = math.sin(dphi / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
-    return 2 * R * math.asin(math.sqrt(a))
-
-def heat_index_c(temp_c: float, rh_pct: float) -> float:
-    # NOAA-ish regression, returned °C. Works best in warm conditions.
+    p1, p2 = np.radians(lat1), math.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dl = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(p1) * math.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * R * np.arcsin(np.sqrt(a))
+
+def heat_index_c_vec(temp_c: np.ndarray, rh_pct: np.ndarray) -> np.ndarray:
+    # NOAA-ish regression over arrays, returned °C. Works best in warm conditions.
+    # NaN in -> NaN out
     T = temp_c * 9.0 / 5.0 + 32.0
     R = rh_pct
     HI = (
@@ -102,92 +133,118 @@ def heat_index_c(temp_c: float, rh_pct: float) -> float:
         + 0.00085282 * T * R * R
         - 0.00000199 * T * T * R * R
     )
-    if T < 80 or R < 40:
-        HI = 0.7 * HI + 0.3 * T
+    HI = np.where((T < 80) | (R < 40), 0.7 * HI + 0.3 * T, HI)
     return (HI - 32.0) * 5.0 / 9.0
 
-def hrv_from_rr(rr_ms_list: List[float]) -> Optional[Dict[str, float]]:
-    rr = [float(x) for x in rr_ms_list if x is not None and math.isfinite(float(x))]
-    rr = [x for x in rr if RR_MIN_MS <= x <= RR_MAX_MS]
-    if len(rr) < 5:
-        return None
-
-    rr_sorted = sorted(rr)
-    med = rr_sorted[len(rr_sorted) // 2]
-    bpm = 60.0 / (med / 1000.0) if med > 0 else None
-
-    mean = sum(rr) / len(rr)
-    sdnn = math.sqrt(sum((x - mean) ** 2 for x in rr) / (len(rr) - 1)) if len(rr) > 1 else None
-
-    dif = [rr[i + 1] - rr[i] for i in range(len(rr) - 1)]
-    rmssd = math.sqrt(sum(d * d for d in dif) / len(dif)) if len(dif) >= 1 else None
-    pnn50 = 100.0 * (sum(1 for d in dif if abs(d) > 50.0) / len(dif)) if dif else None
+def hrv_from_rr_batch(rr_lists: List[List[float]]) -> Dict[str, np.ndarray]:
+    """
+    HRV for every FF in one pass. All RR lists are concatenated with a group id per
+    sample and reduced with bincount. Returns arrays aligned with rr_lists
+    (bpm, sdnn_ms, rmssd_ms, pnn50_pct, n_rr); entries are NaN for an FF with fewer
+    than 5 valid RR intervals.
+    """
+    n_groups = len(rr_lists)
+    lens = np.fromiter((len(x) for x in rr_lists), dtype=np.int64, count=n_groups)
+    rr = np.fromiter(
+        (np.nan if v is None else v for x in rr_lists for v in x),
+        dtype=np.float64, count=int(lens.sum()),
+    )
+    gid = np.repeat(np.arange(n_groups), lens)
+
+    keep = np.isfinite(rr) & (rr >= RR_MIN_MS) & (rr <= RR_MAX_MS)
+    rr, gid = rr[keep], gid[keep]
+    n = np.bincount(gid, minlength=n_groups)
+    ok = n >= 5
+
+    # successive differences, only within the same FF
+    same = gid[1:] == gid[:-1]
+    dif = np.diff(rr)[same]
+    dgid = gid[1:][same]
+    n_dif = np.bincount(dgid, minlength=n_groups)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(gid, weights=rr, minlength=n_groups) / n
+        sdnn = np.sqrt(np.bincount(gid, weights=(rr - mean[gid]) ** 2, minlength=n_groups) / (n - 1))
+        rmssd = np.sqrt(np.bincount(dgid, weights=dif * dif, minlength=n_groups) / n_dif)
+        pnn50 = 100.0 * np.bincount(dgid, weights=(np.abs(dif) > 50.0).astype(np.float64), minlength=n_groups) / n_dif
+
+    # upper median per FF (element n//2 of its sorted RR): sort by (gid, rr) and index into each run
+    med = np.full(n_groups, np.nan)
+    if ok.any():
+        rr_sorted = rr[np.lexsort((rr, gid))]
+        starts = np.cumsum(n) - n
+        med[ok] = rr_sorted[starts[ok] + n[ok] // 2]
+
+    nan = np.nan
+    return {
+        "bpm": np.where(ok, 60000.0 / med, nan),
+        "sdnn_ms": np.where(ok, sdnn, nan),
+        "rmssd_ms": np.where(ok, rmssd, nan),
+        "pnn50_pct": np.where(ok, pnn50, nan),
+        "n_rr": n.astype(np.float64),
+    }
 
-    out = {}
-    if bpm is not None: out["bpm"] = float(bpm)
-    if sdnn is not None: out["sdnn_ms"] = float(sdnn)
-    if rmssd is not None: out["rmssd_ms"] = float(rmssd)
-    if pnn50 is not None: out["pnn50_pct"] = float(pnn50)
-    out["n_rr"] = float(len(rr))
-    return out
+def _fin(x) -> Optional[float]:
+    # numpy scalar -> float, NaN -> None
+    x = float(x)
+    return x if math.isfinite(x) else None
 
 def stress_index(bpm: Optional[float], rmssd_ms: Optional[float], pnn50_pct: Optional[float]) -> Optional[float]:
     if bpm is None or rmssd_ms is None:
         return None
 
-    hr_norm = clamp01((bpm - BASELINE_HR_BPM) / max(1.0, (HR_MAX_BPM - BASELINE_HR_BPM)))
-    rmssd_norm = clamp01(rmssd_ms / max(1.0, BASELINE_RMSSD_MS))
-    rmssd_stress = clamp01(1.0 - rmssd_norm)
+    hr_norm = clamp01((bpm - BASELINE_HR_BPM) * _HR_RANGE_INV)
+    rmssd_norm = clamp01(rmssd_ms * _RMSSD_INV)
+    rmssd_stress = 1.0 - rmssd_norm
 
     if pnn50_pct is not None:
-        pnn50_norm = clamp01(pnn50_pct / 30.0)
-        pnn50_stress = clamp01(1.0 - pnn50_norm)
+        pnn50_norm = clamp01(pnn50_pct * _PNN50_INV)
+        pnn50_stress = 1.0 - pnn50_norm
         score = 0.45 * hr_norm + 0.35 * rmssd_stress + 0.20 * pnn50_stress
     else:
         score = 0.55 * hr_norm + 0.45 * rmssd_stress
 
-    return clamp01(score)
+    # every term is already in [0, 1] and the weights sum to 1, so no outer clamp
+    return score
 
 def fatigue_index(bpm: Optional[float], rmssd_ms: Optional[float], stress01: Optional[float]) -> Optional[float]:
     if bpm is None or rmssd_ms is None:
         return None
-    hr_norm = clamp01((bpm - BASELINE_HR_BPM) / max(1.0, (HR_MAX_BPM - BASELINE_HR_BPM)))
-    rmssd_norm = clamp01(rmssd_ms / max(1.0, BASELINE_RMSSD_MS))
-    hrv_drop = clamp01(1.0 - rmssd_norm)
+    hr_norm = clamp01((bpm - BASELINE_HR_BPM) * _HR_RANGE_INV)
+    rmssd_norm = clamp01(rmssd_ms * _RMSSD_INV)
+    hrv_drop = 1.0 - rmssd_norm
 
     # demo: fatigue = HR load + HRV drop + some stress
     s = 0.0 if stress01 is None else float(stress01)
-    return clamp01(0.50 * hr_norm + 0.35 * hrv_drop + 0.15 * s)
+    return 0.50 * hr_norm + 0.35 * hrv_drop + 0.15 * s
 
 def gas_risk(mq2_raw: Optional[float], co_ppm: Optional[float]) -> Optional[float]:
     # demo threshold mapping (tune later)
     parts = []
     if mq2_raw is not None:
         # ~1800 moderate, ~2600 high, ~3200 extreme
-        x = clamp01((mq2_raw - 1800.0) / 1400.0)
+        x = clamp01((mq2_raw - 1800.0) * _MQ2_RANGE_INV)
         parts.append(x)
     if co_ppm is not None:
         # ~35 moderate, ~100 high, ~150 extreme
-        x = clamp01((co_ppm - 35.0) / 115.0)
+        x = clamp01((co_ppm - 35.0) * _CO_RANGE_INV)
         parts.append(x)
     if not parts:
         return None
-    return clamp01(sum(parts) / len(parts))
+    return sum(parts) / len(parts)
 
-def heat_risk(bpm: Optional[float], temp_c: Optional[float], rh_pct: Optional[float]) -> Tuple[Optional[float], Optional[float]]:
+def heat_risk(bpm: Optional[float], hi_c: Optional[float]) -> Tuple[Optional[float], Optional[float]]:
+    # hi_c: heat index in °C (heat_index_c_vec), None when temp or RH is missing
     if bpm is None:
         return None, None
-    hi_c = None
-    if temp_c is not None and rh_pct is not None:
-        hi_c = float(heat_index_c(float(temp_c), float(rh_pct)))
 
-    hr_norm = clamp01((bpm - BASELINE_HR_BPM) / max(1.0, (HR_MAX_BPM - BASELINE_HR_BPM)))
+    hr_norm = clamp01((bpm - BASELINE_HR_BPM) * _HR_RANGE_INV)
     if hi_c is None:
         return hr_norm, None
 
     # ~32C low, ~46C high
-    hi_norm = clamp01((hi_c - 32.0) / 14.0)
-    return clamp01(0.55 * hr_norm + 0.45 * hi_norm), hi_c
+    hi_norm = clamp01((hi_c - 32.0) * _HI_RANGE_INV)
+    return 0.55 * hr_norm + 0.45 * hi_norm, hi_c
 
 def overall_risk(
     stress01: Optional[float],
@@ -209,6 +266,7 @@ def overall_risk(
     h = float(vals["heat"] or 0.0)
     g = float(vals["gas"] or 0.0)
     p = float(vals["sep"] or 0.0)
+    # W_* come from env and need not sum to 1, so this clamp stays
     return clamp01(W_STRESS * s + W_FATIGUE * f + W_HEAT * h + W_GAS * g + W_SEP * p)
 
 def ngsi_type(v: Any) -> str:
@@ -218,23 +276,37 @@ def ngsi_type(v: Any) -> str:
         return "Number"
     return "Text"
 
-def build_orion_update_entity(team: str, ff: str, attrs: Dict[str, Any]) -> Dict[str, Any]:
+# NGSI type of every attribute compute_updates writes (all rounded floats)
+_ATTR_TYPE = dict.fromkeys((
+    "stressIndex", "fatigueIndex", "heatRisk", "gasRisk", "separationRisk", "riskScore",
+    "rmssdMs", "sdnnMs", "pnn50Pct", "heatIndexC",
+), "Number")
+
+def build_orion_update_entity(team: str, ff: str, attrs: Dict[str, Any],
+                              iso_now: str, ts_now: int) -> Dict[str, Any]:
     # We update the Biomedical entity that already exists:
     eid = f"Wearable:{team}:{ff}"
     ent: Dict[str, Any] = {"id": eid, "type": "Biomedical"}
     for k, v in attrs.items():
-        ent[k] = {"type": ngsi_type(v), "value": v}
-    ent["observedAt"] = {"type": "DateTime", "value": iso(now_utc())}
-    ent["timestamp"] = {"type": "Number", "value": int(time.time())}
+        ent[k] = {"type": _ATTR_TYPE.get(k) or ngsi_type(v), "value": v}
+    ent["observedAt"] = {"type": "DateTime", "value": iso_now}
+    ent["timestamp"] = {"type": "Number", "value": ts_now}
     return ent
 
+# one keep-alive connection to Orion across poll ticks (connect errors retried twice)
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                      max_retries=Retry(total=2, backoff_factor=0.2)))
+
 def orion_append(entities: List[Dict[str, Any]]) -> None:
     if not entities:
         return
     try:
-        r = requests.post(
+        # the whole batch is encoded in one pass (orjson when available)
+        r = _session.post(
             ORION_UPDATE_URL,
-            json={"actionType": "append", "entities": entities},
+            data=_dumps({"actionType": "append", "entities": entities}),
+            headers={"Content-Type": "application/json"},
             timeout=ORION_TIMEOUT,
         )
         if r.status_code not in (200, 201, 204):
@@ -242,126 +314,192 @@ def orion_append(entities: List[Dict[str, Any]]) -> None:
     except Exception as e:
         print(f"[ORION] error: {e}")
 
+# the POST runs on one background thread so it overlaps the next tick's Influx query;
+# a single worker plus waiting on the previous POST keeps at most one write in flight
+_orion_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="orion")
+_orion_pending: Optional[Future] = None
 
-# ----------------- Influx read -----------------
-def need_influx():
-    if not (INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET):
-        raise RuntimeError("Missing INFLUX_TOKEN/INFLUX_ORG/INFLUX_BUCKET")
+def orion_append_background(entities: List[Dict[str, Any]]) -> None:
+    global _orion_pending
+    if not entities:
+        return
+    if _orion_pending is not None:
+        _orion_pending.result()  # orion_append logs its own errors, never raises
+    _orion_pending = _orion_pool.submit(orion_append, entities)
 
-def influx_client() -> InfluxDBClient:
-    need_influx()
-    return InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
 
-def fetch_recent(team: str, lookback_min: int) -> Dict[str, Dict[str, Any]]:
-    """
-    Returns per-ff:
-      {
-        "FF_A": {
-          "hrBpm": last,
-          "rrMs_list": [...],
-          "tempC": last,
-          "humidityPct": last,
-          "mq2Raw": last,
-          "coPpm": last,
-          "lat": last,
-          "lon": last,
-          "activity": last (if present),
-        }, ...
-      }
-    """
-    start = (now_utc() - timedelta(minutes=lookback_min)).isoformat()
-
-    # Pull a few important fields across 3 measurements.
-    # We keep rrMs too (as multiple samples).
-    flux = f'''
-from(bucket: "{INFLUX_BUCKET}")
-  |> range(start: {start})
-  |> filter(fn: (r) => r["teamId"] == "{team}")
+# ----------------- Influx read -----------------
+# numeric fields where only the newest value in the window matters (rrMs is read as a series)
+LAST_FIELDS = ("hrBpm", "tempC", "humidityPct", "mq2Raw", "coPpm", "lat", "lon")
+# ORs of equality tests (unlike contains()) are predicates Influx can push into the
+# storage read, as long as every filter before them in the chain is pushable too
+_LAST_FIELDS_FILTER = " or ".join(f'r["_field"] == "{f}"' for f in LAST_FIELDS)
+
+# Three results in one round-trip:
+#   "latest"   - last value of each numeric field, pivoted to one row per (team, FF)
+#   "activity" - last activity string per (team, FF)
+#   "rr"       - the raw rrMs series per (team, FF), oldest first (HRV needs every sample)
+# The window is bound as params.range. The teams go in as an OR chain (not
+# contains(), which would stop the pushdown) built once per team set; TEAM_IDS is
+# fixed, so the query text is still the same every tick.
+@lru_cache(maxsize=8)
+def _flux_recent(teams: Tuple[str, ...]) -> str:
+    team_filter = " or ".join(f'r["teamId"] == {json.dumps(t)}' for t in teams)
+    return f'''
+data = from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: duration(v: params.range))
   |> filter(fn: (r) =>
       r["_measurement"] == "{MEAS_ENV}" or
       r["_measurement"] == "{MEAS_BIO}" or
       r["_measurement"] == "{MEAS_LOC}"
   )
-  |> filter(fn: (r) =>
-      r["_field"] == "hrBpm" or
-      r["_field"] == "rrMs" or
-      r["_field"] == "tempC" or
-      r["_field"] == "humidityPct" or
-      r["_field"] == "mq2Raw" or
-      r["_field"] == "coPpm" or
-      r["_field"] == "lat" or
-      r["_field"] == "lon" or
-      r["_field"] == "activity"
-  )
-  |> keep(columns: ["_time","_measurement","_field","_value","ffId","teamId"])
-  |> sort(columns: ["_time"], desc: false)
+  |> filter(fn: (r) => {team_filter})
+
+data
+  |> filter(fn: (r) => {_LAST_FIELDS_FILTER})
+  |> last()
+  |> toFloat()
+  |> group(columns: ["teamId","ffId","_field"])
+  |> max(column: "_time")
+  |> group(columns: ["teamId","ffId"])
+  |> pivot(rowKey: ["teamId","ffId"], columnKey: ["_field"], valueColumn: "_value")
+  |> yield(name: "latest")
+
+data
+  |> filter(fn: (r) => r["_field"] == "activity")
+  |> last()
+  |> group(columns: ["teamId","ffId"])
+  |> max(column: "_time")
+  |> keep(columns: ["_value","teamId","ffId"])
+  |> yield(name: "activity")
+
+data
+  |> filter(fn: (r) => r["_field"] == "rrMs")
+  |> group(columns: ["teamId","ffId"])
+  |> sort(columns: ["_time"])
+  |> keep(columns: ["_time","_value","teamId","ffId"])
+  |> yield(name: "rr")
 '''
 
-    per_ff: Dict[str, Dict[str, Any]] = {}
-
-    with influx_client() as client:
-        q = client.query_api()
-        tables = q.query(flux, org=INFLUX_ORG)
+def need_influx():
+    if not (INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET):
+        raise RuntimeError("Missing INFLUX_TOKEN/INFLUX_ORG/INFLUX_BUCKET")
 
-    for table in tables:
-        for rec in table.records:
-            ff = rec.values.get("ffId")
-            if not ff:
-                continue
-            d = per_ff.setdefault(ff, {"rrMs_list": []})
+# one client (and urllib3 pool) for the life of the process; closed when main() exits
+_influx: Optional[InfluxDBClient] = None
 
-            field = rec.get_field()
-            val = rec.get_value()
+def influx_client() -> InfluxDBClient:
+    global _influx
+    need_influx()
+    if _influx is None:
+        _influx = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG, enable_gzip=True)
+    return _influx
 
-            if field == "rrMs":
-                f = safe_float(val)
-                if f is not None:
-                    d["rrMs_list"].append(float(f))
-                continue
+def close_influx() -> None:
+    global _influx
+    if _influx is not None:
+        _influx.close()
+        _influx = None
 
-            # for non-rr fields we keep the LAST seen in the window
-            f = safe_float(val)
-            if field in ("lat", "lon", "tempC", "humidityPct", "mq2Raw", "coPpm", "hrBpm"):
+def fetch_recent(teams: List[str], lookback_min: int) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Returns per-team, per-ff:
+      {
+        "Team_A": {
+          "FF_A": {
+            "hrBpm": last,
+            "rrMs_list": [...],
+            "tempC": last,
+            "humidityPct": last,
+            "mq2Raw": last,
+            "coPpm": last,
+            "lat": last,
+            "lon": last,
+            "activity": last (if present),
+          }, ...
+        }, ...
+      }
+    """
+    per_team: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    if not teams:
+        return per_team
+
+    # records are parsed as the CSV arrives; no FluxTable list is built
+    for rec in influx_client().query_api().query_stream(
+            _flux_recent(tuple(teams)), org=INFLUX_ORG, params={"range": f"-{lookback_min}m"}):
+        vals = rec.values
+        team = vals.get("teamId")
+        ff = vals.get("ffId")
+        if not team or not ff:
+            continue
+        per_ff = per_team.get(team)
+        if per_ff is None:
+            per_ff = per_team[team] = {}
+        d = per_ff.get(ff)
+        if d is None:
+            d = per_ff[ff] = {"rrMs_list": []}
+
+        result = vals.get("result")
+        if result == "rr":
+            f = safe_float(vals.get("_value"))
+            if f is not None:
+                d["rrMs_list"].append(f)
+        elif result == "activity":
+            val = vals.get("_value")
+            if isinstance(val, str):
+                d["activity"] = val
+        else:
+            for field in LAST_FIELDS:
+                f = safe_float(vals.get(field))
                 if f is not None:
-                    d[field] = float(f)
-            elif field == "activity":
-                if isinstance(val, str):
-                    d["activity"] = val
+                    d[field] = f
 
-    return per_ff
+    return per_team
 
 
 # ----------------- main loop -----------------
-def compute_and_publish(team: str) -> None:
-    data = fetch_recent(team, LOOKBACK_MIN)
-    if not data:
-        return
+def compute_updates(team: str, data: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Orion entities for one team's fetch_recent() slice."""
+    ffs = list(data)
+
+    def col(name: str) -> np.ndarray:
+        vals = (safe_float(data[ff].get(name)) for ff in ffs)
+        return np.array([np.nan if v is None else v for v in vals], dtype=np.float64)
+
+    # the scalar math runs once over the whole team as arrays; NaN marks "missing"
+    hrv = hrv_from_rr_batch([data[ff].get("rrMs_list") or [] for ff in ffs])
+    hi_arr = heat_index_c_vec(col("tempC"), col("humidityPct"))
 
     # leader loc for separation
     leader = data.get(LEADER_FF_ID, {})
     leader_lat = safe_float(leader.get("lat"))
     leader_lon = safe_float(leader.get("lon"))
+    if leader_lat is not None and leader_lon is not None:
+        dist_arr = haversine_m_vec(col("lat"), col("lon"), leader_lat, leader_lon)
+    else:
+        dist_arr = np.full(len(ffs), np.nan)
 
     updates: List[Dict[str, Any]] = []
+    # one timestamp for the whole tick, shared by every entity
+    now = now_utc()
+    iso_now = iso(now)
+    ts_now = int(now.timestamp())
 
-    for ff, d in data.items():
-        rr_list = d.get("rrMs_list") or []
-        hrv = hrv_from_rr(rr_list)
-
+    for i, ff in enumerate(ffs):
+        d = data[ff]
         bpm = safe_float(d.get("hrBpm"))
-        if hrv and hrv.get("bpm") is not None:
-            bpm = float(hrv["bpm"])  # prefer RR-derived HR when available
+        rr_bpm = _fin(hrv["bpm"][i])
+        if rr_bpm is not None:
+            bpm = rr_bpm  # prefer RR-derived HR when available
 
-        rmssd = hrv.get("rmssd_ms") if hrv else None
-        sdnn = hrv.get("sdnn_ms") if hrv else None
-        pnn50 = hrv.get("pnn50_pct") if hrv else None
+        rmssd = _fin(hrv["rmssd_ms"][i])
+        sdnn = _fin(hrv["sdnn_ms"][i])
+        pnn50 = _fin(hrv["pnn50_pct"][i])
 
         stx = stress_index(bpm, rmssd, pnn50)
         ftx = fatigue_index(bpm, rmssd, stx)
 
-        temp_c = safe_float(d.get("tempC"))
-        rh_pct = safe_float(d.get("humidityPct"))
-        heat01, hi_c = heat_risk(bpm, temp_c, rh_pct)
+        heat01, hi_c = heat_risk(bpm, _fin(hi_arr[i]))
 
         mq2 = safe_float(d.get("mq2Raw"))
         co = safe_float(d.get("coPpm"))
@@ -369,12 +507,10 @@ def compute_and_publish(team: str) -> None:
 
         # separation risk vs leader
         sep01 = None
-        lat = safe_float(d.get("lat"))
-        lon = safe_float(d.get("lon"))
-        if None not in (leader_lat, leader_lon, lat, lon) and ff != LEADER_FF_ID:
-            dist = haversine_m(float(lat), float(lon), float(leader_lat), float(leader_lon))
+        dist = _fin(dist_arr[i])
+        if dist is not None and ff != LEADER_FF_ID:
             # 0 until ~60m, 1 at ~140m
-            sep01 = clamp01((dist - 60.0) / 80.0)
+            sep01 = clamp01((dist - 60.0) * _SEP_RANGE_INV)
 
         risk01 = overall_risk(stx, ftx, heat01, gas01, sep01)
 
@@ -400,19 +536,50 @@ def compute_and_publish(team: str) -> None:
         if not attrs:
             continue
 
-        updates.append(build_orion_update_entity(team, ff, attrs))
+        updates.append(build_orion_update_entity(team, ff, attrs, iso_now, ts_now))
+    return updates
+
+def compute_and_publish(teams: List[str]) -> None:
+    # one Influx round-trip and one Orion append for every team
+    per_team = fetch_recent(teams, LOOKBACK_MIN)
+    updates: List[Dict[str, Any]] = []
+    for team, data in per_team.items():
+        updates.extend(compute_updates(team, data))
+    if not updates:
+        return
     print(f"[ORION] pushing {len(updates)} updates -> {ORION_UPDATE_URL}")
 
-    orion_append(updates)
+    orion_append_background(updates)
+
+# ticks run here so the loop can give up waiting on one (e.g. a hung Influx read)
+_tick_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tick")
 
 def main():
-    print(f"[risk_processor] team={TEAM_ID} lookback={LOOKBACK_MIN}min poll={POLL_SEC}s")
-    while True:
-        try:
-            compute_and_publish(TEAM_ID)
-        except Exception as e:
-            print(f"[risk_processor] loop error: {e}")
-        time.sleep(POLL_SEC)
+    print(f"[risk_processor] teams={','.join(TEAM_IDS)} lookback={LOOKBACK_MIN}min poll={POLL_SEC}s")
+    tick: Optional[Future] = None
+    next_tick = time.monotonic()
+    try:
+        while True:
+            # never queue a tick behind one that is still running
+            if tick is None or tick.done():
+                tick = _tick_pool.submit(compute_and_publish, TEAM_IDS)
+            try:
+                tick.result(timeout=TICK_TIMEOUT_SEC)
+            except FuturesTimeout:
+                print(f"[risk_processor] tick still running after {TICK_TIMEOUT_SEC:.0f}s")
+            except Exception as e:
+                print(f"[risk_processor] loop error: {e}")
+
+            # fixed-rate schedule: a slow tick shortens the next sleep instead of shifting the cadence
+            next_tick += POLL_SEC
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                print(f"[risk_processor] overrun {-delay:.2f}s")
+                next_tick = time.monotonic()
+            else:
+                time.sleep(delay)
+    finally:
+        close_influx()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("influxdb_client")
+
+import _common  # noqa: E402
+
+
+@pytest.fixture
+def fake_latest(monkeypatch):
+    monkeypatch.setattr(_common, "_LATEST_CACHE", {})
+    monkeypatch.setattr(_common, "_LATEST_LOCKS", {})
+    monkeypatch.setattr(_common, "LATEST_CACHE_MAX", 8)
+    calls = []
+
+    def latest_members(team, minutes):
+        calls.append((team, minutes))
+        return {"FF_A": {"teamId": team, "ffId": "FF_A"}}
+
+    monkeypatch.setattr(_common, "latest_members", latest_members)
+    return calls
+
+
+def test_latest_cache_is_bounded_by_distinct_teams(fake_latest):
+    for i in range(100):
+        _common.latest_members_cached(f"team-{i}", 60)
+
+    assert len(fake_latest) == 100
+    assert len(_common._LATEST_CACHE) <= _common.LATEST_CACHE_MAX
+    assert len(_common._LATEST_LOCKS) <= _common.LATEST_CACHE_MAX
+    # the newest entries survive eviction
+    assert ("team-99", 60) in _common._LATEST_CACHE
+
+
+def test_latest_cache_hit_skips_query(fake_latest):
+    first = _common.latest_members_cached("Team_A", 60)
+    first["FF_A"]["ffId"] = "changed"
+    second = _common.latest_members_cached("Team_A", 60)
+
+    assert fake_latest == [("Team_A", 60)]
+    assert second["FF_A"]["ffId"] == "FF_A"
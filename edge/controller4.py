@@ -170,18 +170,38 @@ last_seen = {}
 last_env = {}
 last_bio = {}
 last_loc = {}
+# team -> (anchor lat, cos(radians(lat))); refreshed when the REAL_FF_ID fix moves
+_anchor_cache: Dict[str, Tuple[float, float]] = {}
 
 def _nowz():
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def haversine(lat1, lon1, lat2, lon2):
+def anchor_cos(team, lat):
+    hit = _anchor_cache.get(team)
+    if hit is None or hit[0] != lat:
+        hit = _anchor_cache[team] = (lat, math.cos(math.radians(lat)))
+    return hit[1]
+
+def haversine(lat1, lon1, lat2, lon2, cos2=None):
+    # cos2: precomputed cos(radians(lat2)) when point 2 is the (slow-moving) anchor
     R = 6371000
-    p1, p2 = math.radians(lat1), math.radians(lat2)
+    if cos2 is None:
+        cos2 = math.cos(math.radians(lat2))
     dphi = math.radians(lat2 - lat1)
     dl = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(p1)*math.cos(p2)*math.sin(dl/2)**2
+    a = math.sin(dphi/2)**2 + math.cos(math.radians(lat1))*cos2*math.sin(dl/2)**2
     return 2*R*math.asin(math.sqrt(a))
 
+M_PER_DEG = math.radians(6371000)  # same sphere as haversine()
+EQUIRECT_MAX_M = 5000  # beyond this the flat approximation drifts; use haversine
+
+def separation_m(lat1, lon1, lat2, lon2, cos2):
+    # local flat-earth distance around the anchor (lat2); mm-accurate at the sep_* ranges
+    d = math.hypot((lon1 - lon2) * cos2 * M_PER_DEG, (lat1 - lat2) * M_PER_DEG)
+    if d > EQUIRECT_MAX_M:
+        return haversine(lat1, lon1, lat2, lon2, cos2)
+    return d
+
 def evaluate(team, ff):
     alerts = []
     key = (team, ff)
@@ -189,7 +209,7 @@ def evaluate(team, ff):
     loc = last_loc.get(key, {})
     anchor = last_loc.get((team, REAL_FF_ID), {})
     if loc and anchor:
-        d = haversine(loc["lat"], loc["lon"], anchor["lat"], anchor["lon"])
+        d = separation_m(loc["lat"], loc["lon"], anchor["lat"], anchor["lon"], anchor_cos(team, anchor["lat"]))
         if d > TH.sep_danger:
             alerts.append({"teamId": team, "ffId": ff, "severity": "danger", "category": "location", "reason": f"Separated ({int(d)}m)", "observedAt": _nowz()})
         elif d > TH.sep_warn:
@@ -274,6 +294,8 @@ def on_message(client, userdata, msg):
 
     if etype == "Location":
         last_loc[(team, ff)] = {"lat": payload["lat"], "lon": payload["lon"], "accuracyM": payload.get("accuracyM", 10)}
+        if ff == REAL_FF_ID:
+            anchor_cos(team, payload["lat"])
 
 # ===================== MAIN ===================== #
 def main():
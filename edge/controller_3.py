@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
+import atexit
 import base64
 import json
 import logging
+import queue
+import re
 import sqlite3
+import threading
 import time
 from dataclasses import dataclass
-from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, Optional, Tuple
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
 import paho.mqtt.client as mqtt
 import requests
-// ADDED LOCATION DATA + RULE ENGINE ALERTS
+from requests.adapters import HTTPAdapter
+# ADDED LOCATION DATA + RULE ENGINE ALERTS
 # ===================== CONFIG ===================== #
 MQTT_BROKER_HOST = "localhost"
 MQTT_BROKER_PORT = 1883
@@ -29,7 +34,12 @@ FIWARE_SERVICEPATH = None
 
 SQLITE_DB_PATH = "edge_data.db"
 ENABLE_SQLITE = True
+SQLITE_BATCH_MAX = 200          # rows per transaction
+SQLITE_BATCH_WINDOW_SEC = 0.1   # how long the writer waits to fill a batch
+SQLITE_QUEUE_MAX = 10000        # rows buffered before new ones are dropped
 ORION_TIMEOUT_SEC = 5
+ORION_QUEUE_MAX = 10000         # message batches buffered for Orion before the oldest are dropped
+ORION_BATCH_MAX = 100           # entities per op/update when the sender catches up
 
 # Frontend MQTT outputs
 ALERTS_TOPIC_PREFIX = "edge/alerts"       # edge/alerts/<team>/<ff>
@@ -38,10 +48,76 @@ STATUS_TOPIC_PREFIX = "edge/status"       # edge/status/<team>/<ff>
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
 # ===================== SQLITE ===================== #
+# The MQTT callbacks only enqueue rows; one writer thread owns the connection and
+# commits them in batches (one transaction, hence one WAL sync, per batch).
+_db: Optional[sqlite3.Connection] = None
+_write_q: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue(maxsize=SQLITE_QUEUE_MAX)
+_writer: Optional[threading.Thread] = None
+
+_INSERT_MEASUREMENT = "INSERT INTO measurements (entity_id, entity_type, topic, payload_json, ts_utc) VALUES (?, ?, ?, ?, ?);"
+_INSERT_RAW_ECG = "INSERT INTO raw_ecg (team_id, ff_id, topic, payload_b64, payload_len, ts_utc) VALUES (?, ?, ?, ?, ?, ?);"
+
+def _write_batch(batch):
+    rows_m = [row for kind, row in batch if kind == "m"]
+    rows_e = [row for kind, row in batch if kind == "e"]
+    try:
+        _db.execute("BEGIN IMMEDIATE")
+        if rows_m:
+            _db.executemany(_INSERT_MEASUREMENT, rows_m)
+        if rows_e:
+            _db.executemany(_INSERT_RAW_ECG, rows_e)
+        _db.execute("COMMIT")
+    except Exception as e:
+        logging.error("❌ SQLite batch of %d rows failed: %s", len(batch), e)
+        if _db.in_transaction:
+            _db.execute("ROLLBACK")
+
+def _db_writer():
+    stop = False
+    while not stop:
+        item = _write_q.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = time.monotonic() + SQLITE_BATCH_WINDOW_SEC
+        while len(batch) < SQLITE_BATCH_MAX:
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                break
+            try:
+                item = _write_q.get(timeout=wait)
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        _write_batch(batch)
+
+def close_db():
+    global _db, _writer
+    if _writer is not None:
+        _write_q.put(None)  # flush what is queued, then stop
+        _writer.join(timeout=5)
+        _writer = None
+    if _db is not None:
+        _db.close()
+        _db = None
+
 def init_db():
+    global _db, _writer
     if not ENABLE_SQLITE:
         return
-    conn = sqlite3.connect(SQLITE_DB_PATH)
+    # autocommit mode: the writer issues BEGIN IMMEDIATE / COMMIT itself
+    conn = sqlite3.connect(SQLITE_DB_PATH, check_same_thread=False, isolation_level=None)
+    # WAL makes a commit one sequential append; NORMAL syncs at checkpoints, not every commit
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA busy_timeout=5000;
+        PRAGMA cache_size=-20000;
+        PRAGMA temp_store=MEMORY;
+    """)
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS measurements (
@@ -64,35 +140,29 @@ def init_db():
             ts_utc TEXT
         );
     """)
-    conn.commit()
-    conn.close()
+    _db = conn
+    _writer = threading.Thread(target=_db_writer, name="sqlite-writer", daemon=True)
+    _writer.start()
+    atexit.register(close_db)
+
+def _enqueue_row(kind: str, row: tuple):
+    try:
+        _write_q.put_nowait((kind, row))
+    except queue.Full:
+        logging.warning("SQLite queue full, dropping %s row", kind)
 
 def store_measurement(entity_id: str, entity_type: str, topic: str, payload: Dict[str, Any]):
-    if not ENABLE_SQLITE:
+    if not ENABLE_SQLITE or _db is None:
         return
-    conn = sqlite3.connect(SQLITE_DB_PATH)
-    c = conn.cursor()
     ts_utc = datetime.now(timezone.utc).isoformat()
-    c.execute(
-        "INSERT INTO measurements (entity_id, entity_type, topic, payload_json, ts_utc) VALUES (?, ?, ?, ?, ?);",
-        (entity_id, entity_type, topic, json.dumps(payload, separators=(",", ":")), ts_utc),
-    )
-    conn.commit()
-    conn.close()
+    _enqueue_row("m", (entity_id, entity_type, topic, json.dumps(payload, separators=(",", ":")), ts_utc))
 
 def store_raw_ecg(team_id: str, ff_id: str, topic: str, payload_bytes: bytes):
-    if not ENABLE_SQLITE:
+    if not ENABLE_SQLITE or _db is None:
         return
-    conn = sqlite3.connect(SQLITE_DB_PATH)
-    c = conn.cursor()
     ts_utc = datetime.now(timezone.utc).isoformat()
     payload_b64 = base64.b64encode(payload_bytes).decode("ascii")
-    c.execute(
-        "INSERT INTO raw_ecg (team_id, ff_id, topic, payload_b64, payload_len, ts_utc) VALUES (?, ?, ?, ?, ?, ?);",
-        (team_id, ff_id, topic, payload_b64, len(payload_bytes), ts_utc),
-    )
-    conn.commit()
-    conn.close()
+    _enqueue_row("e", (team_id, ff_id, topic, payload_b64, len(payload_bytes), ts_utc))
 
 # ===================== NGSI HELPERS ===================== #
 def _attr_type(v: Any) -> str:
@@ -102,6 +172,26 @@ def _attr_type(v: Any) -> str:
         return "Number"
     return "Text"
 
+# Orion answers 400 to a whole request if any string value holds one of these;
+# ids additionally may not contain whitespace, & ? / or #
+_ORION_FORBIDDEN = re.compile(r"""[<>"'=;()]""")
+_ORION_ID_FORBIDDEN = re.compile(r"""[<>"'=;()&?/#\s]""")
+
+def _orion_text(v: Any) -> Any:
+    if isinstance(v, str):
+        return _ORION_FORBIDDEN.sub("", v)
+    if isinstance(v, list):
+        return [_orion_text(x) for x in v]
+    if isinstance(v, dict):
+        return {k: _orion_text(x) for k, x in v.items()}
+    return v
+
+def _orion_safe(ent: Dict[str, Any]) -> Dict[str, Any]:
+    """Strip the characters Orion rejects from every string value and from the id."""
+    ent = _orion_text(ent)
+    ent["id"] = _ORION_ID_FORBIDDEN.sub("", ent["id"])
+    return ent
+
 def _looks_like_iso8601_utc(s: str) -> bool:
     return isinstance(s, str) and len(s) >= 20 and s.endswith("Z") and "T" in s
 
@@ -153,26 +243,88 @@ def build_ngsi_v2_entity(entity_id: str, entity_type: str, payload: Dict[str, An
     if "observedAt" not in payload and "timestamp" not in payload and "tst" not in payload:
         ent["timestamp"] = {"type": "Number", "value": int(time.time())}
 
-    return ent
-
-def send_to_orion_op_update(entity: Dict[str, Any]) -> bool:
-    url = f"{CONTEXT_BROKER_BASE_URL}/v2/op/update"
-    headers = {"Content-Type": "application/json"}
-    if FIWARE_SERVICE:
-        headers["Fiware-Service"] = FIWARE_SERVICE
-    if FIWARE_SERVICEPATH:
-        headers["Fiware-ServicePath"] = FIWARE_SERVICEPATH
-
-    body = {"actionType": "append", "entities": [entity]}
+    return _orion_safe(ent)
+
+# One keep-alive session for every Orion call (url and headers never change)
+ORION_UPDATE_URL = f"{CONTEXT_BROKER_BASE_URL}/v2/op/update"
+_orion = requests.Session()
+_orion.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_orion.headers["Content-Type"] = "application/json"
+if FIWARE_SERVICE:
+    _orion.headers["Fiware-Service"] = FIWARE_SERVICE
+if FIWARE_SERVICEPATH:
+    _orion.headers["Fiware-ServicePath"] = FIWARE_SERVICEPATH
+
+# on_message only enqueues; one sender thread does the HTTP so a slow Orion never
+# stalls the MQTT loop. A single sender keeps updates to an entity in order.
+_orion_q: "queue.Queue[List[Dict[str, Any]]]" = queue.Queue(maxsize=ORION_QUEUE_MAX)
+_orion_sender: Optional[threading.Thread] = None
+
+def _post_to_orion(entities: List[Dict[str, Any]]) -> Optional[int]:
+    """One op/update append; returns the HTTP status, or None if Orion was unreachable."""
+    body = {"actionType": "append", "entities": entities}
     try:
-        r = requests.post(url, headers=headers, json=body, timeout=ORION_TIMEOUT_SEC)
+        r = _orion.post(ORION_UPDATE_URL, json=body, timeout=ORION_TIMEOUT_SEC)
         if r.status_code not in (200, 201, 204):
             logging.warning("Orion %s: %s", r.status_code, r.text[:300])
-            return False
-        return True
+        return r.status_code
     except Exception as e:
         logging.error("❌ Orion send error: %s", e)
-        return False
+        return None
+
+def _send_entities(entities: List[Dict[str, Any]]) -> None:
+    status = _post_to_orion(entities)
+    if status is not None and 400 <= status < 500 and len(entities) > 1:
+        # Orion refuses the whole op/update over one bad entity: send them one by one
+        # so the rest still land
+        for ent in entities:
+            status = _post_to_orion([ent])
+            if status is not None and 400 <= status < 500:
+                logging.error("Orion rejected %s", ent.get("id"))
+
+def _orion_worker():
+    while True:
+        batches = [_orion_q.get()]
+        n = len(batches[0])
+        # whatever queued up during the last POST goes out in the same op/update
+        while n < ORION_BATCH_MAX:
+            try:
+                batch = _orion_q.get_nowait()
+            except queue.Empty:
+                break
+            batches.append(batch)
+            n += len(batch)
+        if len(batches) == 1:
+            _send_entities(batches[0])
+            continue
+        status = _post_to_orion([ent for batch in batches for ent in batch])
+        if status is not None and 400 <= status < 500:
+            # one message's bad entity must not cost the other messages theirs:
+            # resend message by message (the culprit's batch then splits per entity)
+            for batch in batches:
+                _send_entities(batch)
+
+def start_orion_sender():
+    global _orion_sender
+    if _orion_sender is None:
+        _orion_sender = threading.Thread(target=_orion_worker, name="orion-sender", daemon=True)
+        _orion_sender.start()
+
+def send_to_orion_op_update(entities: List[Dict[str, Any]]) -> bool:
+    # one op/update call carries every entity produced for a message
+    if not entities:
+        return True
+    while True:
+        try:
+            _orion_q.put_nowait(entities)
+            return True
+        except queue.Full:
+            # Orion is behind: the oldest batch is the most stale, drop it
+            try:
+                _orion_q.get_nowait()
+                logging.warning("Orion queue full, dropped oldest update batch")
+            except queue.Empty:
+                pass
 
 # ===================== RULE ENGINE ===================== #
 @dataclass
@@ -330,7 +482,7 @@ def build_alert_entity(alert: Dict[str, Any]) -> Dict[str, Any]:
         "value": {"type": _attr_type(alert.get("value")), "value": alert.get("value")},
         "observedAt": {"type": "DateTime", "value": alert.get("observedAt", _nowz())},
     }
-    return ent
+    return _orion_safe(ent)
 
 def build_firefighter_status_entity(summary: Dict[str, Any]) -> Dict[str, Any]:
     eid = f"Firefighter:{summary['teamId']}:{summary['ffId']}"
@@ -348,7 +500,7 @@ def build_firefighter_status_entity(summary: Dict[str, Any]) -> Dict[str, Any]:
         v = summary.get(k)
         if isinstance(v, (int, float)):
             ent[k] = {"type": "Number", "value": float(v)}
-    return ent
+    return _orion_safe(ent)
 
 # ===================== MQTT CALLBACKS ===================== #
 def on_connect(client, userdata, flags, rc):
@@ -399,9 +551,8 @@ def on_message(client, userdata, msg):
     # Store locally
     store_measurement(entity_id, entity_type, topic, payload)
 
-    # Send to Orion
-    entity = build_ngsi_v2_entity(entity_id, entity_type, payload)
-    send_to_orion_op_update(entity)
+    # Orion: the entity itself, plus any alerts/status below, go out as one batch
+    orion_batch = [build_ngsi_v2_entity(entity_id, entity_type, payload)]
 
     # Update in-memory state for rule engine
     if entity_type in ("Environment", "Biomedical", "Location") and team_id and ff_or_node:
@@ -433,14 +584,17 @@ def on_message(client, userdata, msg):
         for a in alerts:
             client.publish(f"{ALERTS_TOPIC_PREFIX}/{team_id}/{ff_or_node}", json.dumps(a), qos=0, retain=False)
             # also store in Orion as Alert entity (optional but useful for Grafana)
-            send_to_orion_op_update(build_alert_entity(a))
+            orion_batch.append(build_alert_entity(a))
 
         # Also store consolidated status in Orion (optional but VERY useful)
-        send_to_orion_op_update(build_firefighter_status_entity(summary))
+        orion_batch.append(build_firefighter_status_entity(summary))
+
+    send_to_orion_op_update(orion_batch)
 
 # ===================== MAIN ===================== #
 def main():
     init_db()
+    start_orion_sender()
     client = mqtt.Client()
     client.on_connect = on_connect
     client.on_message = on_message
@@ -1,22 +1,47 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import json
 import os
+import re
 import time
-from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional, List, Tuple
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, List, Set, Tuple
 
+import httpx
 import requests
-from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
-from influxdb_client import InfluxDBClient
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.middleware.gzip import GZipMiddleware
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+from requests.adapters import HTTPAdapter
 
 try:
     import paho.mqtt.client as mqtt
 except Exception:  # pragma: no cover
     mqtt = None
 
-app = FastAPI()
+try:
+    import aiomqtt
+except Exception:  # pragma: no cover
+    aiomqtt = None
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+except Exception:  # pragma: no cover
+    orjson = None
+
+if orjson is not None:
+    _dumps = orjson.dumps
+    app = FastAPI(default_response_class=ORJSONResponse)
+else:  # pragma: no cover
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    app = FastAPI()
+
+# /api/latest and /api/alerts bodies are verbose JSON; compress anything over 1 KiB
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 # ---- ENV ----
 INFLUX_URL = os.getenv("INFLUX_URL", "http://influxdb:8086")
@@ -42,6 +67,37 @@ MEAS_WEATHER = os.getenv("MEAS_WEATHER", "WeatherObserved")
 # Location cache behavior
 LOC_CACHE_TTL_SEC = int(os.getenv("LOC_CACHE_TTL_SEC", "3600"))  # keep last known for 1h by default
 
+# /api/weather: Orion answers are cached this long (the weather agent refreshes slowly)
+WEATHER_CACHE_TTL_SEC = float(os.getenv("WEATHER_CACHE_TTL_SEC", "30"))
+# after a failed Orion call, the stale (or failure) answer is served this long before retrying
+WEATHER_RETRY_SEC = float(os.getenv("WEATHER_RETRY_SEC", "5"))
+
+# /api/latest and /api/alerts: identical polls within this window share one answer
+RESP_CACHE_TTL_SEC = float(os.getenv("RESP_CACHE_TTL_SEC", "5"))
+
+# /api/action: actions arriving within this window reach Orion as one op/update
+ACTION_BATCH_SEC = float(os.getenv("ACTION_BATCH_SEC", "0.02"))
+ACTION_BATCH_MAX = int(os.getenv("ACTION_BATCH_MAX", "100"))
+
+# Shared async HTTP client for Orion (created at startup, closed at shutdown)
+HTTP: Optional[httpx.AsyncClient] = None
+
+
+def _http() -> httpx.AsyncClient:
+    global HTTP
+    if HTTP is None:
+        HTTP = httpx.AsyncClient(
+            timeout=httpx.Timeout(5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return HTTP
+
+
+# Keep-alive session for the sync Orion lookups (/api/latest fallback, /api/actions)
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=0))
+SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=0))
+
 
 def _now_utc() -> datetime:
     return datetime.now(timezone.utc)
@@ -65,9 +121,9 @@ def _need_influx():
         raise HTTPException(500, "Missing INFLUX_TOKEN/INFLUX_ORG/INFLUX_BUCKET in environment")
 
 
-def _influx_client() -> InfluxDBClient:
-    _need_influx()
-    return InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
+# One async Influx client for the whole process. It owns an aiohttp session, so it is
+# created on the running loop at startup and closed at shutdown.
+ASYNC_INFLUX: Optional[InfluxDBClientAsync] = None
 
 
 # -----------------------------------------------------------------------------
@@ -154,7 +210,7 @@ def _start_mqtt_location_cache():
         if not team or not ff:
             return
 
-        lat, lon, obs = _payload_to_latlon(bytes(msg.payload))
+        lat, lon, obs = _payload_to_latlon(msg.payload)
         if lat is None or lon is None:
             return
 
@@ -183,15 +239,34 @@ def _start_mqtt_location_cache():
 
 @app.on_event("startup")
 async def _on_startup():
-    try:
-        _start_mqtt_location_cache()
-    except Exception:
-        pass
+    global ASYNC_INFLUX, _mqtt_task
+    _http()
+    _action_queue()
+    if INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET:
+        ASYNC_INFLUX = InfluxDBClientAsync(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
+    # one shared MQTT session feeds the location cache and every /ws/ecg viewer;
+    # the paho thread is only the location-cache fallback when aiomqtt is missing
+    if aiomqtt is not None:
+        if _mqtt_task is None:
+            _mqtt_task = asyncio.create_task(_mqtt_dispatch())
+    else:
+        try:
+            _start_mqtt_location_cache()
+        except Exception:
+            pass
 
 
 @app.on_event("shutdown")
 async def _on_shutdown():
-    global _mqtt_loc_client
+    global _mqtt_loc_client, HTTP, ASYNC_INFLUX, _action_task, _mqtt_task
+    if _mqtt_task is not None:
+        _mqtt_task.cancel()
+        _mqtt_task = None
+
+    if _action_task is not None:
+        _action_task.cancel()
+        _action_task = None
+
     try:
         if _mqtt_loc_client is not None:
             _mqtt_loc_client.loop_stop()
@@ -200,13 +275,28 @@ async def _on_shutdown():
         pass
     _mqtt_loc_client = None
 
+    try:
+        if HTTP is not None:
+            await HTTP.aclose()
+    except Exception:
+        pass
+    HTTP = None
+    SESSION.close()
+
+    try:
+        if ASYNC_INFLUX is not None:
+            await ASYNC_INFLUX.close()
+    except Exception:
+        pass
+    ASYNC_INFLUX = None
+
 
 # -----------------------------------------------------------------------------
 # ORION HELPERS (keyValues)
 # -----------------------------------------------------------------------------
 def _orion_get_keyvalues(entity_id: str, timeout: float = 3.0) -> Optional[Dict[str, Any]]:
     try:
-        r = requests.get(
+        r = SESSION.get(
             f"{ORION_BASE.rstrip('/')}/v2/entities/{entity_id}",
             params={"options": "keyValues"},
             timeout=timeout,
@@ -272,70 +362,178 @@ def _merge_orion_for_ff(members: Dict[str, Dict[str, Any]], team: str, ff: str)
         _merge_if_missing_str(m, "locObservedAt", p.get("observedAt"))
 
 
+# -----------------------------------------------------------------------------
+# RESPONSE CACHE (per endpoint/team/window, single-flight)
+# -----------------------------------------------------------------------------
+# key -> (monotonic ts, (body, etag)); a miss in progress parks followers on its Future
+_resp_cache: Dict[Tuple[Any, ...], Tuple[float, Tuple[Any, str]]] = {}
+_resp_inflight: Dict[Tuple[Any, ...], asyncio.Future] = {}
+
+
+async def _cached(key: Tuple[Any, ...], fetch) -> Tuple[Any, str]:
+    """(body, etag) for key; the ETag is hashed once per fill, not per request."""
+    now = time.monotonic()
+    hit = _resp_cache.get(key)
+    if hit is not None and hit[0] > now - RESP_CACHE_TTL_SEC:
+        return hit[1]
+
+    fut = _resp_inflight.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+
+    fut = asyncio.get_running_loop().create_future()
+    _resp_inflight[key] = fut
+    try:
+        body = await fetch()
+        raw = body if isinstance(body, bytes) else _dumps(body)
+        out = (body, '"%s"' % hashlib.blake2b(raw, digest_size=8).hexdigest())
+        if len(_resp_cache) > 256:
+            for k in [k for k, v in _resp_cache.items() if v[0] <= now - RESP_CACHE_TTL_SEC]:
+                del _resp_cache[k]
+        _resp_cache[key] = (time.monotonic(), out)
+        fut.set_result(out)
+        return out
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved; followers (if any) still get it
+        raise
+    finally:
+        _resp_inflight.pop(key, None)
+        if not fut.done():
+            fut.cancel()
+
+
+def _conditional(request: Request, response: Response, cached: Tuple[Any, str]):
+    # unchanged since the client's last poll: 304 with no body
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": f"max-age={int(RESP_CACHE_TTL_SEC)}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if isinstance(body, bytes):  # pre-encoded JSON (see _alerts_uncached)
+        return Response(content=body, media_type="application/json", headers=headers)
+    response.headers.update(headers)
+    return body
+
+
 # -----------------------------------------------------------------------------
 # API
 # -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# FLUX (built once; team, window and limit are bound per call through Influx query params)
+# -----------------------------------------------------------------------------
+WANTED_FIELDS = (
+    "hrBpm", "rrMs",
+    "tempC", "humidityPct", "mq2Raw", "mq2Digital", "coPpm",
+    "stressIndex", "fatigueIndex", "riskScore",
+    "heatRisk", "heatIndexC", "gasRisk", "separationRisk",
+    "rmssdMs", "sdnnMs", "pnn50Pct",
+    "lat", "lon",
+)
+# an OR of equality tests (unlike contains()) is a predicate Influx can push into the storage read
+_WANTED_FIELDS_FILTER = " or ".join(f'r["_field"] == "{f}"' for f in WANTED_FIELDS)
+
+# Influx reduces to the last value per (ffId, field) and pivots to one row per FF;
+# a second result carries each FF's newest sample time (the pivot drops _time).
+LATEST_FLUX = f'''
+lastByFF = from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: duration(v: params.range))
+  |> filter(fn: (r) => r["teamId"] == params.team)
+  |> filter(fn: (r) =>
+      r["_measurement"] == "{MEAS_ENV}" or
+      r["_measurement"] == "{MEAS_BIO}" or
+      r["_measurement"] == "{MEAS_LOC}"
+  )
+  |> filter(fn: (r) => {_WANTED_FIELDS_FILTER})
+  |> last()
+  |> toFloat()
+  |> group(columns: ["ffId","_field"])
+  |> sort(columns: ["_time"])
+  |> last()
+
+lastByFF
+  |> group(columns: ["ffId"])
+  |> pivot(rowKey: ["ffId"], columnKey: ["_field"], valueColumn: "_value")
+  |> yield(name: "values")
+
+lastByFF
+  |> group(columns: ["ffId"])
+  |> max(column: "_time")
+  |> keep(columns: ["_time","ffId"])
+  |> yield(name: "times")
+'''
+
+ALERTS_FLUX = f'''
+from(bucket: "{INFLUX_BUCKET}")
+  |> range(start: duration(v: params.range))
+  |> filter(fn: (r) => r["_measurement"] == "{MEAS_ALERTS}")
+  |> filter(fn: (r) => r["teamId"] == params.team)
+  |> keep(columns: ["_time","_field","_value","ffId","teamId"])
+  |> pivot(rowKey: ["_time","ffId"], columnKey: ["_field"], valueColumn: "_value")
+  |> group()
+  |> sort(columns: ["_time"], desc: true)
+  |> limit(n: params.limit)
+'''
+
+# Pivoted alert rows carry these besides the alert fields themselves
+_ALERT_META_COLS = frozenset({"result", "table", "_start", "_stop", "_time", "ffId", "teamId"})
+
+
 @app.get("/api/health")
 def health():
     return {"ok": True, "ts": _iso(_now_utc()), "orionBase": ORION_BASE}
 
 
 @app.get("/api/latest")
-def latest(team: str = Query(...), minutes: int = Query(60, ge=1, le=240)):
+async def latest(
+    request: Request,
+    response: Response,
+    team: str = Query(...),
+    minutes: int = Query(60, ge=1, le=240),
+):
     """
     Primary: Influx (Environment/Biomedical/Location)
     Always merge: MQTT cached coords for ngsi/Location/+/+ if missing
     Fallback/merge: Orion (Wearable/EnvNode/Phone) if Influx empty or missing important fields
     """
+    cached = await _cached(("latest", team, minutes), lambda: _latest_uncached(team, minutes))
+    return _conditional(request, response, cached)
+
+
+async def _latest_uncached(team: str, minutes: int) -> Dict[str, Any]:
     members: Dict[str, Dict[str, Any]] = {}
 
     # ---- 1) Try Influx (if configured) ----
-    influx_ok = bool(INFLUX_TOKEN and INFLUX_ORG and INFLUX_BUCKET)
+    influx_ok = ASYNC_INFLUX is not None
     if influx_ok:
-        since = _now_utc() - timedelta(minutes=minutes)
-        start = since.isoformat()
-
-        wanted_fields = [
-            "hrBpm", "rrMs",
-            "tempC", "humidityPct", "mq2Raw", "mq2Digital", "coPpm",
-            "stressIndex", "fatigueIndex", "riskScore",
-            "heatRisk", "heatIndexC", "gasRisk", "separationRisk",
-            "rmssdMs", "sdnnMs", "pnn50Pct",
-            "lat", "lon",
-        ]
-        field_filter = " or ".join([f'r["_field"] == "{f}"' for f in wanted_fields])
-
-        flux = f'''
-from(bucket: "{INFLUX_BUCKET}")
-  |> range(start: {start})
-  |> filter(fn: (r) => r["teamId"] == "{team}")
-  |> filter(fn: (r) =>
-      r["_measurement"] == "{MEAS_ENV}" or
-      r["_measurement"] == "{MEAS_BIO}" or
-      r["_measurement"] == "{MEAS_LOC}"
-  )
-  |> filter(fn: (r) => {field_filter})
-  |> keep(columns: ["_time","_measurement","_field","_value","ffId","teamId"])
-  |> sort(columns: ["_time"], desc: false)
-'''
         try:
-            with InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG) as client:
-                tables = client.query_api().query(flux, org=INFLUX_ORG)
+            tables = await ASYNC_INFLUX.query_api().query(
+                LATEST_FLUX, org=INFLUX_ORG, params={"team": team, "range": f"-{minutes}m"}
+            )
+            # locals, not globals, inside the per-row loop
+            to_iso = _iso
+            fields = WANTED_FIELDS
             for table in tables:
                 for rec in table.records:
-                    ff = rec.values.get("ffId")
+                    vals = rec.values
+                    ff = vals.get("ffId")
                     if not ff:
                         continue
-                    m = members.setdefault(ff, {"teamId": team, "ffId": ff})
-                    field = rec.get_field()
-                    val = rec.get_value()
-                    t = rec.get_time()
-                    if t:
-                        m["observedAt"] = _iso(t)
-                    fval = _safe_float(val)
-                    if fval is None:
+                    m = members.get(ff)
+                    if m is None:
+                        m = members[ff] = {"teamId": team, "ffId": ff}
+                    if vals.get("result") == "times":
+                        t = vals.get("_time")
+                        if t is not None:
+                            m["observedAt"] = to_iso(t)
                         continue
-                    m[field] = fval
+                    for f in fields:
+                        raw = vals.get(f)
+                        if raw is None:
+                            continue
+                        try:
+                            m[f] = float(raw)
+                        except (TypeError, ValueError):
+                            pass
         except Exception:
             # Don't fail the endpoint if Influx is flaky; we'll fallback to Orion.
             pass
@@ -372,14 +570,20 @@ from(bucket: "{INFLUX_BUCKET}")
                 break
 
     if need_orion:
+        # the Orion lookups are blocking requests calls; keep them off the event loop
         for ff in list(members.keys()):
-            _merge_orion_for_ff(members, team, ff)
+            await asyncio.to_thread(_merge_orion_for_ff, members, team, ff)
 
     # optional: drop completely empty placeholder members if you prefer.
     # but keeping FF_A..FF_D helps the UI
     return {"team": team, "members": list(members.values())}
 
 
+# entity id -> (monotonic ts, response); the lock makes concurrent misses share one Orion call
+_weather_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_weather_lock = asyncio.Lock()
+
+
 def _weather_risk_from_wind(wind_ms: Optional[float]) -> str:
     if wind_ms is None:
         return "LOW"
@@ -390,53 +594,152 @@ def _weather_risk_from_wind(wind_ms: Optional[float]) -> str:
     return "LOW"
 
 
-@app.get("/api/weather")
-def weather(lat: float = Query(...), lon: float = Query(...)):
-    # 1) ORION (primary)
+async def _fetch_orion_weather() -> Optional[Dict[str, Any]]:
     try:
-        r = requests.get(
+        r = await _http().get(
             f"{ORION_BASE.rstrip('/')}/v2/entities/{WEATHER_ENTITY_ID}",
             params={"options": "keyValues"},
             timeout=3,
         )
-        if r.status_code == 200:
-            d = r.json() or {}
-            temp_c = _safe_float(d.get("temperature"))
-            wind_ms = _safe_float(d.get("windSpeed"))
-            wind_dir = _safe_float(d.get("windDirection"))
-            hum = _safe_float(d.get("humidityPct"))
-            if hum is None:
-                hum = _safe_float(d.get("humidity"))
-            if hum is None:
-                hum = _safe_float(d.get("relativeHumidity"))
-            if hum is None:
-                hum = _safe_float(d.get("rh"))
-            obs = d.get("timestamp") or d.get("observedAt")
-
-            out = {"ok": True, "source": "orion", "risk": _weather_risk_from_wind(wind_ms)}
-            if temp_c is not None:
-                out["tempC"] = temp_c
-            if wind_ms is not None:
-                out["windMs"] = wind_ms
-            if wind_dir is not None:
-                out["windDirDeg"] = wind_dir
-            if hum is not None:
-                out["humidityPct"] = hum
-            if isinstance(obs, str) and obs:
-                out["observedAt"] = obs
-            return out
+        if r.status_code != 200:
+            return None
+        d = r.json() or {}
     except Exception:
-        pass
+        return None
+
+    temp_c = _safe_float(d.get("temperature"))
+    wind_ms = _safe_float(d.get("windSpeed"))
+    wind_dir = _safe_float(d.get("windDirection"))
+    hum = _safe_float(d.get("humidityPct"))
+    if hum is None:
+        hum = _safe_float(d.get("humidity"))
+    if hum is None:
+        hum = _safe_float(d.get("relativeHumidity"))
+    if hum is None:
+        hum = _safe_float(d.get("rh"))
+    obs = d.get("timestamp") or d.get("observedAt")
+
+    out = {"ok": True, "source": "orion", "risk": _weather_risk_from_wind(wind_ms)}
+    if temp_c is not None:
+        out["tempC"] = temp_c
+    if wind_ms is not None:
+        out["windMs"] = wind_ms
+    if wind_dir is not None:
+        out["windDirDeg"] = wind_dir
+    if hum is not None:
+        out["humidityPct"] = hum
+    if isinstance(obs, str) and obs:
+        out["observedAt"] = obs
+    return out
+
+
+@app.get("/api/weather")
+async def weather(lat: float = Query(...), lon: float = Query(...)):
+    # The Orion entity is fixed (WEATHER_ENTITY_ID), so one cache entry serves every lat/lon.
+    hit = _weather_cache.get(WEATHER_ENTITY_ID)
+    if hit is not None and hit[0] > time.monotonic() - WEATHER_CACHE_TTL_SEC:
+        return hit[1]
+
+    async with _weather_lock:
+        hit = _weather_cache.get(WEATHER_ENTITY_ID)
+        if hit is not None and hit[0] > time.monotonic() - WEATHER_CACHE_TTL_SEC:
+            return hit[1]
+
+        # 1) ORION (primary)
+        out = await _fetch_orion_weather()
+        if out is not None:
+            _weather_cache[WEATHER_ENTITY_ID] = (time.monotonic(), out)
+            return out
+
+        # 2) Orion unreachable: last good answer beats none. Either way, cache it so it
+        # looks fresh for WEATHER_RETRY_SEC and the waiters behind the lock return it
+        # instead of each making their own attempt.
+        out = hit[1] if hit is not None else {"ok": False, "reason": "Weather fetch failed", "risk": "LOW"}
+        _weather_cache[WEATHER_ENTITY_ID] = (time.monotonic() - WEATHER_CACHE_TTL_SEC + WEATHER_RETRY_SEC, out)
+        return out
+
+
+# -----------------------------------------------------------------------------
+# ACTION BATCHER (one Orion op/update per burst of /api/action calls)
+# -----------------------------------------------------------------------------
+_action_q: Optional[asyncio.Queue] = None
+_action_task: Optional[asyncio.Task] = None
 
-    return {"ok": False, "reason": "Weather fetch failed", "risk": "LOW"}
+
+def _action_queue() -> asyncio.Queue:
+    global _action_q, _action_task
+    if _action_q is None:
+        _action_q = asyncio.Queue()
+    if _action_task is None:
+        _action_task = asyncio.create_task(_action_batcher())
+    return _action_q
+
+
+# characters Orion refuses in entity ids (non-printable ASCII, & ? / # and the
+# general forbidden set), so a bad teamId/ffId is a 400 here and never reaches a batch
+_ORION_ID_BAD = re.compile(r"""[^\x21-\x7e]|[&?/#()<>"'=;]""")
+
+
+async def _post_entities(entities: List[Dict[str, Any]]) -> Tuple[Optional[int], Optional[str]]:
+    """One op/update append; returns (status, error), error is None on success."""
+    try:
+        r = await _http().post(
+            f"{ORION_BASE.rstrip('/')}/v2/op/update",
+            json={"actionType": "append", "entities": entities},
+            timeout=5,
+        )
+    except Exception as e:
+        return None, f"Orion unreachable: {e}"
+    if r.status_code not in (200, 201, 204):
+        return r.status_code, f"Orion error: {r.status_code} {r.text[:200]}"
+    return r.status_code, None
+
+
+async def _post_actions(batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+    status, err = await _post_entities([ent for ent, _ in batch])
+    if err is not None and status is not None and 400 <= status < 500 and len(batch) > 1:
+        # Orion rejects the whole op/update for one bad entity: re-post them one by
+        # one so only the caller whose entity is at fault gets the error
+        results = await asyncio.gather(*(_post_entities([ent]) for ent, _ in batch))
+    else:
+        results = [(status, err)] * len(batch)
+
+    for (_, fut), (_, e) in zip(batch, results):
+        if fut.done():  # caller went away
+            continue
+        if e is None:
+            fut.set_result(None)
+        else:
+            fut.set_exception(HTTPException(502, e))
+
+
+async def _action_batcher():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _action_q.get()]
+        deadline = loop.time() + ACTION_BATCH_SEC
+        while len(batch) < ACTION_BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_action_q.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        try:
+            await _post_actions(batch)
+        except Exception:
+            pass
 
 
 @app.post("/api/action")
-def action(payload: Dict[str, Any]):
+async def action(payload: Dict[str, Any]):
     team = payload.get("teamId")
     if not team:
         raise HTTPException(400, "teamId is required")
     ff = payload.get("ffId") or "ALL"
+    if _ORION_ID_BAD.search(str(team)) or _ORION_ID_BAD.search(str(ff)):
+        raise HTTPException(400, "teamId/ffId contain characters Orion does not allow in ids")
     action_name = payload.get("action") or "UNKNOWN"
     note = payload.get("note") or ""
     ts = int(time.time())
@@ -453,18 +756,10 @@ def action(payload: Dict[str, Any]):
         "timestamp": {"type": "Number", "value": ts},
     }
 
-    try:
-        r = requests.post(
-            f"{ORION_BASE.rstrip('/')}/v2/op/update",
-            json={"actionType": "append", "entities": [ent]},
-            timeout=5,
-        )
-    except Exception as e:
-        raise HTTPException(502, f"Orion unreachable: {e}")
-
-    if r.status_code not in (200, 201, 204):
-        raise HTTPException(502, f"Orion error: {r.status_code} {r.text[:200]}")
-
+    # resolved (or failed with the Orion error) once the batch holding it is posted
+    fut = asyncio.get_running_loop().create_future()
+    await _action_queue().put((ent, fut))
+    await fut
     return {"ok": True, "id": eid}
 
 
@@ -477,7 +772,7 @@ def actions(
     since_ts = int(time.time()) - int(minutes * 60)
 
     try:
-        r = requests.get(
+        r = SESSION.get(
             f"{ORION_BASE.rstrip('/')}/v2/entities",
             params={
                 "type": "CommandAction",
@@ -518,110 +813,191 @@ def actions(
 
 
 @app.get("/api/alerts")
-def alerts(
+async def alerts(
+    request: Request,
+    response: Response,
     team: str = Query(...),
     minutes: int = Query(180, ge=1, le=1440),
     limit: int = Query(200, ge=1, le=2000),
 ):
     _need_influx()
-    since = _now_utc() - timedelta(minutes=minutes)
-    start = since.isoformat()
+    cached = await _cached(("alerts", team, minutes, limit), lambda: _alerts_uncached(team, minutes, limit))
+    return _conditional(request, response, cached)
 
-    flux = f'''
-from(bucket: "{INFLUX_BUCKET}")
-  |> range(start: {start})
-  |> filter(fn: (r) => r["_measurement"] == "{MEAS_ALERTS}")
-  |> filter(fn: (r) => r["teamId"] == "{team}")
-  |> keep(columns: ["_time","_field","_value","ffId","teamId"])
-  |> sort(columns: ["_time"], desc: true)
-'''
-    acc: Dict[str, Dict[str, Any]] = {}
 
+async def _alerts_uncached(team: str, minutes: int, limit: int) -> bytes:
+    """
+    The /api/alerts JSON document, already encoded. Records are pulled one at a time from the
+    Influx CSV stream and each row is serialised as it arrives, so neither a table list nor a
+    list of row dicts is ever held alongside the output.
+    """
+    if ASYNC_INFLUX is None:
+        raise HTTPException(503, "Influx client not ready")
+
+    # one row per alert, newest first and already limited by Flux
+    out = bytearray(b'{"team":' + _dumps(team) + b',"alerts":[')
+    first = True
+    to_iso = _iso
+    meta = _ALERT_META_COLS
     try:
-        with _influx_client() as client:
-            tables = client.query_api().query(flux, org=INFLUX_ORG)
-    except Exception as e:
-        raise HTTPException(502, f"Influx query failed: {type(e).__name__}: {str(e)[:200]}")
-
-    for table in tables:
-        for rec in table.records:
-            ff = rec.values.get("ffId") or ""
-            t = rec.get_time()
+        records = await ASYNC_INFLUX.query_api().query_stream(
+            ALERTS_FLUX, org=INFLUX_ORG, params={"team": team, "range": f"-{minutes}m", "limit": limit}
+        )
+        async for rec in records:
+            vals = rec.values
+            t = vals.get("_time")
             if not t:
                 continue
-            k = f"{ff}|{t.isoformat()}"
-            row = acc.setdefault(k, {"teamId": team, "ffId": ff, "observedAt": _iso(t)})
-
-            field = rec.get_field()
-            val = rec.get_value()
-            if isinstance(val, (int, float)):
-                row[field] = float(val)
-            else:
-                row[field] = str(val)
+            row = {"teamId": team, "ffId": vals.get("ffId") or "", "observedAt": to_iso(t)}
+            for k, v in vals.items():
+                if v is None or k in meta:
+                    continue
+                row[k] = float(v) if isinstance(v, (int, float)) else str(v)
+            if not first:
+                out += b","
+            out += _dumps(row)
+            first = False
+    except Exception as e:
+        raise HTTPException(502, f"Influx query failed: {type(e).__name__}: {str(e)[:200]}")
 
-    rows: List[Dict[str, Any]] = list(acc.values())
-    rows.sort(key=lambda r: r.get("observedAt", ""), reverse=True)
-    return {"team": team, "alerts": rows[:limit]}
+    out += b"]}"
+    return bytes(out)
 
 
 # -----------------------------------------------------------------------------
 # WebSocket ECG bridge
 # -----------------------------------------------------------------------------
+class _EcgSub:
+    """One /ws/ecg connection: bounded frame queue + flag set when the viewer fell behind."""
+    __slots__ = ("q", "slow")
+
+    def __init__(self, maxsize: int = 64):
+        self.q: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.slow = False
+
+
+# Keyed by (teamId, ffId) -> /ws/ecg connections watching that FF. raw/ECG/<team>/<ff>
+# is subscribed only while its key is here, so idle workers don't pull ECG traffic.
+_ECG_FANOUT: Dict[Tuple[str, str], Set[_EcgSub]] = {}
+_mqtt_task: Optional[asyncio.Task] = None
+_mqtt_client = None  # the connected aiomqtt.Client, None while (re)connecting
+MQTT_RECONNECT_SEC = 3
+
+
+def _ecg_topic(key: Tuple[str, str]) -> str:
+    return f"raw/ECG/{key[0]}/{key[1]}"
+
+
+async def _ecg_subscribe(key: Tuple[str, str]) -> None:
+    # while disconnected there is nothing to do: _mqtt_dispatch subscribes every
+    # _ECG_FANOUT key when it reconnects
+    if _mqtt_client is not None:
+        try:
+            await _mqtt_client.subscribe(_ecg_topic(key), 0)
+        except Exception:
+            pass
+
+
+async def _ecg_unsubscribe(key: Tuple[str, str]) -> None:
+    if _mqtt_client is not None:
+        try:
+            await _mqtt_client.unsubscribe(_ecg_topic(key))
+        except Exception:
+            pass
+
+
+async def _mqtt_dispatch():
+    """
+    Single MQTT session for the whole API (reconnects on failure):
+      ngsi/Location/<team>/<ff> -> _location_cache
+      raw/ECG/<team>/<ff>       -> every viewer registered in _ECG_FANOUT
+    """
+    global _mqtt_client
+    while True:
+        try:
+            async with aiomqtt.Client(MQTT_HOST, MQTT_PORT, keepalive=30) as client:
+                # no await between the snapshot and publishing the client, so a viewer
+                # either is in the snapshot or subscribes itself through _ecg_subscribe
+                topics = [("ngsi/Location/+/+", 0)] + [(_ecg_topic(k), 0) for k in _ECG_FANOUT]
+                _mqtt_client = client
+                await client.subscribe(topics)
+                async for msg in client.messages:
+                    topic = msg.topic.value
+                    if not topic.startswith("raw/ECG/"):
+                        team, ff = _parse_team_ff_from_topic(topic)
+                        if team and ff:
+                            lat, lon, obs = _payload_to_latlon(msg.payload)
+                            if lat is not None and lon is not None:
+                                _cache_prune()
+                                _cache_set(team, ff, lat, lon, obs)
+                        continue
+
+                    parts = topic.split("/")
+                    subs = _ECG_FANOUT.get((parts[2], parts[3])) if len(parts) >= 4 else None
+                    if not subs:
+                        continue
+                    payload = msg.payload  # already bytes; queued as-is for every viewer
+                    for sub in subs:
+                        try:
+                            sub.q.put_nowait(payload)
+                        except asyncio.QueueFull:
+                            # never drop a frame mid-waveform; the viewer gets disconnected instead
+                            sub.slow = True
+        except asyncio.CancelledError:
+            _mqtt_client = None
+            raise
+        except Exception:
+            _mqtt_client = None
+            await asyncio.sleep(MQTT_RECONNECT_SEC)
+
+
 @app.websocket("/ws/ecg")
 async def ws_ecg(ws: WebSocket, team: str = Query(...), ff: str = Query(...)):
-    if mqtt is None:
+    if aiomqtt is None:
         await ws.accept()
-        await ws.send_text("ERROR: paho-mqtt not installed in api container")
+        await ws.send_text("ERROR: aiomqtt not installed in api container")
         await ws.close()
         return
 
     await ws.accept()
 
-    topic = f"raw/ECG/{team}/{ff}"
-    loop = asyncio.get_running_loop()
-    aq: asyncio.Queue[bytes] = asyncio.Queue(maxsize=50)
-
-    def on_connect(client, userdata, flags, rc):
-        if rc == 0:
-            client.subscribe(topic, qos=0)
-
-    def on_message(client, userdata, msg):
-        payload = bytes(msg.payload)
-
-        def _put():
-            try:
-                if aq.full():
-                    try:
-                        aq.get_nowait()
-                    except Exception:
-                        pass
-                aq.put_nowait(payload)
-            except Exception:
-                pass
-
-        loop.call_soon_threadsafe(_put)
+    # team/ff become an MQTT topic level: no wildcards or extra levels
+    if any(c in team + ff for c in "+#/") or not team or not ff:
+        await ws.send_text("ERROR: invalid team/ff")
+        await ws.close()
+        return
 
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
-    client.connect(MQTT_HOST, MQTT_PORT, keepalive=30)
-    client.loop_start()
+    # frames arrive via the shared MQTT dispatch task (see _mqtt_dispatch)
+    key = (team, ff)
+    sub = _EcgSub(maxsize=64)
+    subs = _ECG_FANOUT.get(key)
+    if subs is None:
+        subs = _ECG_FANOUT[key] = {sub}
+        await _ecg_subscribe(key)
+    else:
+        subs.add(sub)
 
     try:
         while True:
+            if sub.slow:
+                # 1013 "try again later": app.js reconnects and resumes with a clean stream
+                subs.discard(sub)
+                await ws.close(code=1013)
+                return
             try:
-                payload = await asyncio.wait_for(aq.get(), timeout=5.0)
-                await ws.send_bytes(payload)
+                payload = await asyncio.wait_for(sub.q.get(), timeout=5.0)
             except asyncio.TimeoutError:
+                # keepalive tick so proxies don't kill idle WS
                 await ws.send_bytes(b"")
+                continue
+            await ws.send_bytes(payload)
     except WebSocketDisconnect:
         pass
     finally:
-        try:
-            client.loop_stop()
-            client.disconnect()
-        except Exception:
-            pass
+        subs.discard(sub)
+        if not subs and _ECG_FANOUT.get(key) is subs:
+            _ECG_FANOUT.pop(key, None)
+            await _ecg_unsubscribe(key)
         try:
             await ws.close()
         except Exception:
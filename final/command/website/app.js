@@ -1413,7 +1413,16 @@ function ecgConnect(team, ff) {
       }
     } catch (e) { console.warn(e); }
   };
-  ws.onclose = () => { ECG.connected=false; ecgSetStatus("Disconnected (WS closed)"); };
+  ws.onclose = (ev) => {
+    ECG.connected=false;
+    // 1013: server shed us for falling behind; start a fresh stream if still selected
+    if (ev.code === 1013 && ECG.ws === ws) {
+      ecgSetStatus("Reconnecting (client too slow)…");
+      setTimeout(() => { if (ECG.ws === ws) ecgConnect(team, ff); }, 1000);
+      return;
+    }
+    ecgSetStatus("Disconnected (WS closed)");
+  };
   ws.onerror = () => { ECG.connected=false; ecgSetStatus("WebSocket error"); };
   ECG.ws = ws;
 }